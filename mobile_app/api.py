@@ -1,20 +1,281 @@
 ################################################################################
 # IMPORTS 
 ################################################################################
+import base64
+import bisect
 import frappe
+import functools
+import hashlib
+import hmac
 import json
+import math
+import os
+import pickle
 import re
-from frappe.utils import flt, add_days, today
+import time
+import unicodedata
+from frappe.utils import add_days, cint, flt, today
+from frappe.realtime import get_website_room
+from frappe.utils.password import get_encryption_key
+from frappe.utils.response import send_private_file
+from werkzeug.wrappers import Response
+
+
+################################################################################
+#####################  Helper — Endpoint Metrics ###############################
+################################################################################
+
+# Every whitelisted endpoint is wrapped by `instrument_endpoint`, which records
+# its wall time, the number of queries it ran and their total time. A sample
+# costs one pipelined Redis round trip: HINCRBYs on the endpoint's hash holding
+# a latency histogram and running sums, and on a per-minute histogram that
+# expires. `get_mobile_metrics` renders them in the Prometheus text format; its
+# p50/p95/p99 gauges cover the last METRICS_WINDOW_MINUTES minutes only, so they
+# follow current latency instead of the lifetime histogram.
+METRICS_KEY_PREFIX     = "mobile_app:metrics:"
+METRICS_ENDPOINTS_KEY  = "mobile_app:metrics:endpoints"
+METRICS_BUCKETS_MS     = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+METRICS_QUANTILES      = (0.5, 0.95, 0.99)
+METRICS_WINDOW_MINUTES = 5
+METRICS_MINUTE_TTL     = 2 * METRICS_WINDOW_MINUTES * 60
+
+
+def _metrics_minute_key(endpoint, minute):
+    return f"{METRICS_KEY_PREFIX}{endpoint}:{minute:%Y%m%d%H%M}"
+
+
+def instrument_endpoint(fn):
+    """Decorator recording the metrics of an endpoint; goes right below `@frappe.whitelist()`."""
+    endpoint = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        # Endpoints calling each other are measured once, as the outer endpoint
+        if getattr(frappe.local, "mobile_metrics", None) is not None:
+            return fn(*args, **kwargs)
+
+        stats  = frappe.local.mobile_metrics = {"queries": 0, "db_time": 0.0}
+        db     = frappe.db
+        db_sql = db.sql
+        patched_sql = db.__dict__.get("sql")
+
+        def counting_sql(*sql_args, **sql_kwargs):
+            start = time.perf_counter()
+            try:
+                return db_sql(*sql_args, **sql_kwargs)
+            finally:
+                stats["queries"] += 1
+                stats["db_time"] += time.perf_counter() - start
+
+        db.sql = counting_sql
+        failed = False
+        start  = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if patched_sql is None:
+                db.__dict__.pop("sql", None)
+            else:
+                db.sql = patched_sql
+            frappe.local.mobile_metrics = None
+            _record_endpoint_sample(endpoint, elapsed, stats, failed)
+
+    return wrapper
+
+
+def _record_endpoint_sample(endpoint, elapsed, stats, failed):
+    elapsed_ms = elapsed * 1000
+    bucket = next((str(bound) for bound in METRICS_BUCKETS_MS if elapsed_ms <= bound), "inf")
+    try:
+        cache      = frappe.cache()
+        key        = cache.make_key(METRICS_KEY_PREFIX + endpoint)
+        minute_key = cache.make_key(_metrics_minute_key(endpoint, frappe.utils.now_datetime()))
+        pipe       = cache.pipeline(transaction=False)
+        pipe.hincrby(minute_key, f"le:{bucket}", 1)
+        pipe.expire(minute_key, METRICS_MINUTE_TTL)
+        pipe.hincrby(key, f"le:{bucket}", 1)
+        pipe.hincrby(key, "count", 1)
+        pipe.hincrby(key, "sum_us", int(elapsed * 1e6))
+        pipe.hincrby(key, "queries", stats["queries"])
+        pipe.hincrby(key, "db_us", int(stats["db_time"] * 1e6))
+        if failed:
+            pipe.hincrby(key, "errors", 1)
+        pipe.sadd(cache.make_key(METRICS_ENDPOINTS_KEY), endpoint)
+        pipe.execute()
+    except Exception:
+        # Metrics must never fail the request they measure
+        pass
+
+
+def _histogram_quantile(quantile, buckets, count):
+    """
+    Estimates a quantile (in ms) from [(upper_bound_ms, count)] buckets, the last
+    bound being None, by linear interpolation inside the bucket that holds it.
+    NaN without samples, +Inf when the quantile falls past the last finite bound.
+    """
+    if not count:
+        return math.nan
+    rank  = quantile * count
+    seen  = 0
+    lower = 0
+    for upper, bucket_count in buckets:
+        if bucket_count and seen + bucket_count >= rank:
+            if upper is None:
+                return math.inf
+            return lower + (upper - lower) * (rank - seen) / bucket_count
+        seen += bucket_count
+        lower = upper if upper is not None else lower
+    return lower
+
+
+def _format_metric_value(value):
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf"
+    return f"{value:g}"
+
+
+@frappe.whitelist(allow_guest=True)
+def get_mobile_metrics():
+    """
+    Prometheus scrape endpoint for the mobile endpoint metrics. Open to a System
+    Manager session, or to the bearer token set as `mobile_app_metrics_token` in
+    site config.
+    """
+    token = frappe.conf.get("mobile_app_metrics_token")
+    if not (token and hmac.compare_digest(frappe.get_request_header("Authorization") or "", f"Bearer {token}")):
+        frappe.only_for("System Manager")
+
+    # Samples sadd through a raw pipeline; the wrapper's smembers would prefix the key twice
+    cache = frappe.cache()
+    pipe  = cache.pipeline(transaction=False)
+    pipe.smembers(cache.make_key(METRICS_ENDPOINTS_KEY))
+    endpoints = sorted(e.decode() for e in pipe.execute()[0])
+    now       = frappe.utils.now_datetime()
+    minutes   = [frappe.utils.add_to_date(now, minutes=-i) for i in range(METRICS_WINDOW_MINUTES)]
+
+    # Per endpoint: its lifetime hash, then its minute hashes of the window
+    pipe = cache.pipeline(transaction=False)
+    for endpoint in endpoints:
+        pipe.hgetall(cache.make_key(METRICS_KEY_PREFIX + endpoint))
+        for minute in minutes:
+            pipe.hgetall(cache.make_key(_metrics_minute_key(endpoint, minute)))
+    hashes = [{field.decode(): int(value) for field, value in raw.items()} for raw in pipe.execute()]
+    stride = 1 + METRICS_WINDOW_MINUTES
+
+    duration  = ["# HELP mobile_app_request_duration_seconds Wall time of mobile endpoints.",
+                 "# TYPE mobile_app_request_duration_seconds histogram"]
+    quantiles = ["# HELP mobile_app_request_duration_quantile_seconds Latency quantiles over the last "
+                 f"{METRICS_WINDOW_MINUTES} minutes, estimated from the histogram.",
+                 "# TYPE mobile_app_request_duration_quantile_seconds gauge"]
+    queries   = ["# HELP mobile_app_db_queries_total Database queries run by mobile endpoints.",
+                 "# TYPE mobile_app_db_queries_total counter"]
+    db_time   = ["# HELP mobile_app_db_duration_seconds_total Time spent in database queries by mobile endpoints.",
+                 "# TYPE mobile_app_db_duration_seconds_total counter"]
+    errors    = ["# HELP mobile_app_request_errors_total Mobile endpoint calls that raised.",
+                 "# TYPE mobile_app_request_errors_total counter"]
+
+    for i, endpoint in enumerate(endpoints):
+        sample  = hashes[i * stride]
+        window  = hashes[i * stride + 1: (i + 1) * stride]
+        label   = f'endpoint="{endpoint}"'
+        count   = sample.get("count", 0)
+        bounds  = [*METRICS_BUCKETS_MS, None]
+        buckets = [(bound, sample.get(f"le:{bound or 'inf'}", 0)) for bound in bounds]
+
+        window_buckets = [(bound, sum(minute.get(f"le:{bound or 'inf'}", 0) for minute in window)) for bound in bounds]
+        window_count   = sum(bucket_count for _bound, bucket_count in window_buckets)
+
+        cumulative = 0
+        for bound, bucket_count in buckets:
+            cumulative += bucket_count
+            le = "+Inf" if bound is None else f"{bound / 1000:g}"
+            duration.append(f'mobile_app_request_duration_seconds_bucket{{{label},le="{le}"}} {cumulative}')
+        duration.append(f"mobile_app_request_duration_seconds_sum{{{label}}} {sample.get('sum_us', 0) / 1e6:g}")
+        duration.append(f"mobile_app_request_duration_seconds_count{{{label}}} {count}")
+
+        for quantile in METRICS_QUANTILES:
+            value = _format_metric_value(_histogram_quantile(quantile, window_buckets, window_count) / 1000)
+            quantiles.append(f'mobile_app_request_duration_quantile_seconds{{{label},quantile="{quantile}"}} {value}')
+
+        queries.append(f"mobile_app_db_queries_total{{{label}}} {sample.get('queries', 0)}")
+        db_time.append(f"mobile_app_db_duration_seconds_total{{{label}}} {sample.get('db_us', 0) / 1e6:g}")
+        errors.append(f"mobile_app_request_errors_total{{{label}}} {sample.get('errors', 0)}")
+
+    body = "\n".join(duration + quantiles + queries + db_time + errors) + "\n"
+    return Response(body, content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 ################################################################################
 ####################  Helper — Get User From SID Token #########################
 ################################################################################
 
+# A resolved SID is kept in Redis for SESSION_CACHE_TTL seconds and mirrored in
+# a worker-local map for SESSION_LOCAL_TTL seconds. The local TTL is kept short
+# because a logout handled by another worker only clears the Redis entry.
+# A Redis entry is only trusted while frappe still holds the SID in its own
+# "session" cache, which frappe clears when a session is deleted (logout,
+# clear_sessions on a password change, expiry cleanup).
+# Hit/miss counts are kept per worker and added to the shared Redis counters by
+# the next pipeline that goes to Redis anyway, so a local hit stays Redis-free.
+SESSION_CACHE_TTL = 300
+SESSION_LOCAL_TTL = 30
+SESSION_LOCAL_MAX_ENTRIES = 10000
+SESSION_STATS_KEY = "mobile_app:session_cache_stats"
+SESSION_STATS_FIELDS = ("local_hits", "redis_hits", "misses")
+
+_session_cache = {}
+_session_stats = {}
+
+
+def _session_cache_key(token):
+    return f"mobile_app:sid:{token}"
+
+
 def get_user_from_sid(token):
-    """Retrieves the ERPNext user from the session SID using direct SQL query on tabSessions."""
+    """Retrieves the ERPNext user from the session SID, going through the worker-local
+    and Redis session caches before falling back to a query on tabSessions."""
     if not token:
         return None
+
+    local_key = (frappe.local.site, token)
+    entry = _session_cache.get(local_key)
+    if entry:
+        if entry[1] > time.monotonic():
+            _count_session_cache("local_hits")
+            return entry[0]
+        _session_cache.pop(local_key, None)
+
+    cache = frappe.cache()
+    pipe  = cache.pipeline()
+    pipe.get(cache.make_key(_session_cache_key(token)))
+    pipe.hexists(cache.make_key("session"), token)
+    _flush_session_cache_stats(pipe)
+    cached_user, session_alive, *_flushed = pipe.execute()
+
+    if cached_user and session_alive:
+        _count_session_cache("redis_hits")
+        user = pickle.loads(cached_user)
+    else:
+        _count_session_cache("misses")
+        user = _get_user_from_sessions_table(token)
+        if not user:
+            cache.delete_value(_session_cache_key(token))
+            return None
+        cache.set_value(_session_cache_key(token), user, expires_in_sec=SESSION_CACHE_TTL)
+
+    if len(_session_cache) >= SESSION_LOCAL_MAX_ENTRIES:
+        _session_cache.clear()
+    _session_cache[local_key] = (user, time.monotonic() + SESSION_LOCAL_TTL)
+    return user
+
+
+def _get_user_from_sessions_table(token):
     try:
         result = frappe.db.sql(
             "SELECT user, status FROM tabSessions WHERE sid=%s LIMIT 1",
@@ -28,37 +289,668 @@ def get_user_from_sid(token):
     return None
 
 
+def _count_session_cache(field):
+    pending = _session_stats.setdefault(frappe.local.site, dict.fromkeys(SESSION_STATS_FIELDS, 0))
+    pending[field] += 1
+
+
+def _flush_session_cache_stats(pipe):
+    """Queues this worker's pending hit/miss counts on `pipe`."""
+    cache   = frappe.cache()
+    pending = _session_stats.pop(frappe.local.site, {})
+    for field, count in pending.items():
+        if count:
+            pipe.incrby(cache.make_key(f"{SESSION_STATS_KEY}:{field}"), count)
+
+
+def invalidate_session_cache(token):
+    """Drops a SID from both session cache tiers (Redis and this worker)."""
+    if not token:
+        return
+    _session_cache.pop((frappe.local.site, token), None)
+    frappe.cache().delete_value(_session_cache_key(token))
+
+
+def on_logout(login_manager=None):
+    """`on_logout` hook: forget the SID that is being logged out."""
+    invalidate_session_cache(frappe.session.sid)
+
+
+@frappe.whitelist()
+@instrument_endpoint
+def get_session_cache_stats():
+    """
+    Returns the hit/miss counters of the session cache, summed over all workers.
+    Other workers' counts since their last Redis round trip are not included yet.
+    """
+    frappe.only_for("System Manager")
+
+    cache = frappe.cache()
+    pipe  = cache.pipeline()
+    _flush_session_cache_stats(pipe)
+    pipe.mget([cache.make_key(f"{SESSION_STATS_KEY}:{field}") for field in SESSION_STATS_FIELDS])
+    counts = pipe.execute()[-1]
+
+    stats = {field: int(count or 0) for field, count in zip(SESSION_STATS_FIELDS, counts, strict=True)}
+    stats["worker_local_entries"] = len(_session_cache)
+    return stats
+
+
+################################################################################
+#####################  Helper — Worker + Redis Cache ###########################
+################################################################################
+
+# Generic two-tier cache used for per-user / per-customer lookups: a value is
+# stored in Redis (shared by all workers) and mirrored in a worker-local map for
+# a few seconds so the hot path does not even need a Redis round trip.
+LOCAL_CACHE_TTL = 30
+LOCAL_CACHE_MAX_ENTRIES = 10000
+
+_local_cache = {}
+
+
+def _get_cached(key, builder, local_ttl=LOCAL_CACHE_TTL, expires_in_sec=None, version=None):
+    """Returns the value cached under `key`, calling `builder()` on a miss.
+    A builder result of None is not cached. When `version` is given, the
+    worker-local copy is only used while it was stored under the same version."""
+    local_key = (frappe.local.site, key)
+    entry = _local_cache.get(local_key)
+    if entry and entry[1] > time.monotonic() and entry[2] == version:
+        return entry[0]
+
+    value = frappe.cache().get_value(key)
+    if value is None:
+        value = builder()
+        if value is None:
+            return None
+        frappe.cache().set_value(key, value, expires_in_sec=expires_in_sec)
+
+    if len(_local_cache) >= LOCAL_CACHE_MAX_ENTRIES:
+        _local_cache.clear()
+    _local_cache[local_key] = (value, time.monotonic() + local_ttl, version)
+    return value
+
+
+def _invalidate_cached(key):
+    _local_cache.pop((frappe.local.site, key), None)
+    frappe.cache().delete_value(key)
+
+
+################################################################################
+####################  Helper — User Permission Snapshot ########################
+################################################################################
+
+COMPANY_PERMISSION_DOCTYPES   = ("Material Request", "Stock Entry")
+WAREHOUSE_PERMISSION_DOCTYPES = ("Material Request", "Stock Entry", "Warehouse")
+
+
+# Even with the after-commit invalidation, a snapshot expires after
+# PERMISSION_CACHE_TTL so a missed invalidation cannot outlive it.
+PERMISSION_CACHE_TTL = 600
+
+
+def _permission_cache_key(user):
+    return f"mobile_app:user_permissions:{user}"
+
+
 def get_user_permissions(user):
     """
-    Returns the allowed companies and warehouses for a given user.
+    Returns the allowed companies and warehouses for a given user as frozensets.
     Filters out permissions restricted to irrelevant doctypes using 'applicable_for'.
+    The snapshot is cached until a User Permission of that user changes, and at
+    most PERMISSION_CACHE_TTL seconds.
     """
-    # Fetch company permissions
-    company_perms = frappe.get_all(
+    return _get_cached(
+        _permission_cache_key(user),
+        lambda: _build_user_permissions(user),
+        expires_in_sec=PERMISSION_CACHE_TTL
+    )
+
+
+def _build_user_permissions(user):
+    perms = frappe.get_all(
         "User Permission",
-        filters={"user": user, "allow": "Company"},
-        fields=["for_value", "applicable_for"]
+        filters={"user": user, "allow": ["in", ["Company", "Warehouse"]]},
+        fields=["allow", "for_value", "applicable_for"]
     )
-    
-    allowed_companies = []
-    for perm in company_perms:
+
+    allowed_companies  = set()
+    allowed_warehouses = set()
+    for perm in perms:
+        applicable_for = perm.get("applicable_for")
         # Include if it's global OR specifically allowed for material requests/stock entry
-        if not perm.get("applicable_for") or perm.get("applicable_for") in ["Material Request", "Stock Entry"]:
-            allowed_companies.append(perm.get("for_value"))
+        if perm.get("allow") == "Company":
+            if not applicable_for or applicable_for in COMPANY_PERMISSION_DOCTYPES:
+                allowed_companies.add(perm.get("for_value"))
+        elif not applicable_for or applicable_for in WAREHOUSE_PERMISSION_DOCTYPES:
+            allowed_warehouses.add(perm.get("for_value"))
 
-    # Fetch warehouse permissions
-    warehouse_perms = frappe.get_all(
-        "User Permission",
-        filters={"user": user, "allow": "Warehouse"},
-        fields=["for_value", "applicable_for"]
+    return frozenset(allowed_companies), frozenset(allowed_warehouses)
+
+
+def invalidate_user_permissions(doc, method=None):
+    """
+    `doc_events` hook on User Permission: drop the cached snapshot of the user once
+    the transaction commits, so a concurrent request cannot re-cache the old rows.
+    """
+    users = {doc.user}
+    before = doc.get_doc_before_save() if hasattr(doc, "get_doc_before_save") else None
+    if before:
+        users.add(before.user)
+    for user in users:
+        if user:
+            frappe.db.after_commit.add(functools.partial(_invalidate_cached, _permission_cache_key(user)))
+
+
+################################################################################
+####################  Helper — Customer Code Resolution ########################
+################################################################################
+
+# Redis entries also expire on their own, as a safety net for writes that
+# bypass the Customer hooks (e.g. frappe.db.set_value from other apps).
+CUSTOMER_CACHE_TTL = 600
+
+# Only identity, price list and contact fields are cached; the debt fields
+# change with every payment and are read live (CUSTOMER_DEBT_FIELDS).
+CUSTOMER_FIELDS = ["name", "customer_name", "email_id", "mobile_no",
+                   "custom_customer_code", "default_price_list"]
+CUSTOMER_DEBT_FIELDS = ["custom_debt", "custom_debt_date"]
+
+
+def _customer_cache_key(code):
+    return f"mobile_app:customer_by_code:{code}"
+
+
+def get_customer_by_code(code):
+    """
+    Resolves a mobile customer code to its Customer row (name, default price list
+    and contact fields). Returns None when no customer carries that code.
+    The returned dict is shared with the cache and must not be mutated.
+    """
+    if not code:
+        return None
+    return _get_cached(
+        _customer_cache_key(code),
+        lambda: _build_customer_by_code(code),
+        expires_in_sec=CUSTOMER_CACHE_TTL
     )
-    
-    allowed_warehouses = []
-    for perm in warehouse_perms:
-        if not perm.get("applicable_for") or perm.get("applicable_for") in ["Material Request", "Stock Entry", "Warehouse"]:
-            allowed_warehouses.append(perm.get("for_value"))
 
-    return allowed_companies, allowed_warehouses
+
+def _build_customer_by_code(code):
+    customer = frappe.get_all(
+        "Customer",
+        filters={"custom_customer_code": code},
+        fields=CUSTOMER_FIELDS,
+        limit=1
+    )
+    return customer[0] if customer else None
+
+
+def invalidate_customer_code(*codes):
+    for code in codes:
+        if code:
+            _invalidate_cached(_customer_cache_key(code))
+
+
+def on_customer_change(doc, method=None):
+    """
+    `doc_events` hook on Customer: drop the cached entry of its current and previous
+    code once the transaction commits.
+    """
+    before = doc.get_doc_before_save() if hasattr(doc, "get_doc_before_save") else None
+    frappe.db.after_commit.add(functools.partial(
+        invalidate_customer_code, doc.get("custom_customer_code"), before and before.get("custom_customer_code")
+    ))
+
+
+################################################################################
+####################  Helper — Price Resolution Engine #########################
+################################################################################
+
+# Effective selling rates are materialized per price list in a Redis hash
+# (item_code -> rate) with the fallback price list already merged in. Every
+# write bumps a version stamp; workers keep a local copy of each hash and only
+# reload it when the stamp moved. A build that raced with a write (the stamp
+# moved while it read the rates) drops its hash so the next reader rebuilds it.
+FALLBACK_PRICE_LIST = "Public - Alger"
+
+PRICE_MAP_VERSION_KEY = "mobile_app:price_map_version"
+PRICE_MAP_LISTS_KEY   = "mobile_app:price_map_lists"
+PRICE_MAP_BUILT_FIELD = "__built__"
+
+_price_maps = {}
+
+
+def _price_map_key(price_list):
+    return f"mobile_app:price_map:{price_list}"
+
+
+def _get_price_map_version():
+    cache = frappe.cache()
+    return int(cache.get(cache.make_key(PRICE_MAP_VERSION_KEY)) or 0)
+
+
+def get_price_map(price_list):
+    """
+    Returns {item_code: effective selling rate} for a price list. Items without a
+    rate in `price_list` take the rate of FALLBACK_PRICE_LIST; items with no
+    rate in either list are absent. The returned dict must not be mutated.
+    """
+    price_list = price_list or FALLBACK_PRICE_LIST
+    version    = _get_price_map_version()
+    local_key  = (frappe.local.site, price_list)
+
+    entry = _price_maps.get(local_key)
+    if entry and entry[0] == version:
+        return entry[1]
+
+    price_map = frappe.cache().hgetall(_price_map_key(price_list))
+    if price_map.pop(PRICE_MAP_BUILT_FIELD, None) is None:
+        price_map = _build_price_map(price_list)
+
+    _price_maps[local_key] = (version, price_map)
+    return price_map
+
+
+def _build_price_map(price_list):
+    version     = _get_price_map_version()
+    price_lists = {price_list, FALLBACK_PRICE_LIST}
+    rows = frappe.get_all(
+        "Item Price",
+        filters={"price_list": ["in", list(price_lists)], "selling": 1},
+        fields=["item_code", "price_list", "price_list_rate"]
+    )
+    own_rates      = {r.item_code: r.price_list_rate for r in rows if r.price_list == price_list}
+    fallback_rates = {r.item_code: r.price_list_rate for r in rows if r.price_list == FALLBACK_PRICE_LIST}
+
+    price_map = {}
+    for code in own_rates.keys() | fallback_rates.keys():
+        rate = own_rates.get(code) or fallback_rates.get(code)
+        if rate:
+            price_map[code] = flt(rate)
+
+    cache = frappe.cache()
+    key   = cache.make_key(_price_map_key(price_list))
+    mapping = {code: pickle.dumps(rate) for code, rate in price_map.items()}
+    mapping[PRICE_MAP_BUILT_FIELD] = pickle.dumps(1)
+
+    pipe = cache.pipeline()
+    pipe.delete(key)
+    pipe.hset(key, mapping=mapping)
+    pipe.sadd(cache.make_key(PRICE_MAP_LISTS_KEY), price_list)
+    pipe.execute()
+
+    # refresh_item_prices patches the hash and bumps the stamp in one transaction:
+    # if the stamp is unchanged, any later refresh patches the hash written above.
+    if _get_price_map_version() != version:
+        cache.delete(key)
+    return price_map
+
+
+def refresh_item_prices(item_codes):
+    """Recomputes the effective rate of `item_codes` in every materialized price list."""
+    item_codes = [code for code in set(item_codes) if code]
+    if not item_codes:
+        return
+
+    cache       = frappe.cache()
+    price_lists = [pl.decode() for pl in cache.smembers(PRICE_MAP_LISTS_KEY)]
+
+    pipe = cache.pipeline()
+    if price_lists:
+        rows = frappe.get_all(
+            "Item Price",
+            filters={
+                "item_code":  ["in", item_codes],
+                "price_list": ["in", list({*price_lists, FALLBACK_PRICE_LIST})],
+                "selling":    1,
+            },
+            fields=["item_code", "price_list", "price_list_rate"]
+        )
+        rates = {(r.price_list, r.item_code): r.price_list_rate for r in rows}
+
+        for price_list in price_lists:
+            key = cache.make_key(_price_map_key(price_list))
+            for code in item_codes:
+                rate = rates.get((price_list, code)) or rates.get((FALLBACK_PRICE_LIST, code))
+                if rate:
+                    pipe.hset(key, code, pickle.dumps(flt(rate)))
+                else:
+                    pipe.hdel(key, code)
+
+    pipe.incr(cache.make_key(PRICE_MAP_VERSION_KEY))
+    pipe.execute()
+
+
+def on_item_price_change(doc, method=None):
+    """`doc_events` hook on Item Price: refresh the affected items once the transaction commits."""
+    before     = doc.get_doc_before_save() if hasattr(doc, "get_doc_before_save") else None
+    item_codes = {doc.item_code, before and before.item_code}
+    frappe.db.after_commit.add(lambda: refresh_item_prices(item_codes))
+    enqueue_catalog_snapshots()
+
+
+################################################################################
+#########################  Helper — Opaque Tokens ##############################
+################################################################################
+
+def _encode_token(payload):
+    """Packs a JSON-serializable payload into an opaque, URL-safe token."""
+    raw = json.dumps(payload, separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_token(token):
+    """Reverses `_encode_token`. Raises frappe.ValidationError on a malformed token."""
+    try:
+        return json.loads(base64.urlsafe_b64decode(str(token).encode()))
+    except Exception:
+        raise frappe.ValidationError("Invalid token")
+
+
+def _encode_cursor(sort_value, name):
+    """Keyset pagination cursor pointing just after the row (sort_value, name)."""
+    return _encode_token([str(sort_value), name])
+
+
+def _decode_cursor(cursor):
+    """Returns (sort_value, name) from `_encode_cursor`. Raises frappe.ValidationError."""
+    value = _decode_token(cursor)
+    if not isinstance(value, list) or len(value) != 2:
+        raise frappe.ValidationError("Invalid cursor")
+    return value[0], value[1]
+
+
+def _keyset_filters(filters, date_field, cursor, descending=True):
+    """
+    Restricts `filters` to the rows after `cursor` in (date_field, name) order
+    (DESC by default) and returns the `or_filters` that complete the seek
+    condition, e.g. date <= d AND (date < d OR name < n).
+    """
+    cursor_date, cursor_name = _decode_cursor(cursor)
+    op = "<" if descending else ">"
+    filters[date_field] = [f"{op}=", cursor_date]
+    return {date_field: [op, cursor_date], "name": [op, cursor_name]}
+
+
+def _next_cursor(rows, date_field, limit):
+    """Cursor of the page that follows `rows`, or None when this was the last one."""
+    if not rows or len(rows) < limit:
+        return None
+    return _encode_cursor(rows[-1][date_field], rows[-1]["name"])
+
+
+################################################################################
+#######################  Helper — Background Mobile Jobs #######################
+################################################################################
+
+# Write endpoints can hand their insert/submit to a background worker. The job
+# status lives in Redis so the app can poll it with `get_job_status`.
+MOBILE_JOB_QUEUE = "short"
+MOBILE_JOB_TTL   = 24 * 3600
+
+
+def _job_status_key(job_id):
+    return f"mobile_app:job:{job_id}"
+
+
+def set_job_status(job_id, status, **details):
+    frappe.cache().set_value(
+        _job_status_key(job_id), {"status": status, **details}, expires_in_sec=MOBILE_JOB_TTL
+    )
+
+
+def enqueue_mobile_job(job_method, queue=MOBILE_JOB_QUEUE, **job_kwargs):
+    """Queues `job_method(**job_kwargs)` after commit and returns the id to poll."""
+    job_id = frappe.generate_hash(length=20)
+    set_job_status(job_id, "queued")
+    frappe.enqueue(
+        "mobile_app.api.run_mobile_job",
+        queue=queue,
+        enqueue_after_commit=True,
+        job_method=job_method,
+        mobile_job_id=job_id,
+        job_kwargs=job_kwargs,
+    )
+    return job_id
+
+
+def run_mobile_job(job_method, mobile_job_id, job_kwargs):
+    """Runs a queued mobile job. `result` is the response the synchronous call would have returned."""
+    set_job_status(mobile_job_id, "running")
+    frappe.flags.mobile_job_id = mobile_job_id
+    try:
+        result = frappe.get_attr(job_method)(**job_kwargs)
+        frappe.db.commit()
+        set_job_status(mobile_job_id, "finished", result=result)
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(frappe.get_traceback(), f"Mobile job error ({job_method})")
+        set_job_status(mobile_job_id, "failed", error=str(e))
+
+
+def set_job_progress(done, total):
+    """Reports the progress of the running mobile job to `get_job_status` and the desk."""
+    if frappe.flags.mobile_job_id:
+        set_job_status(frappe.flags.mobile_job_id, "running", progress={"done": done, "total": total})
+    frappe.publish_progress(done * 100 / total if total else 100, title="Mobile job")
+
+
+@frappe.whitelist(allow_guest=True)
+@instrument_endpoint
+def get_job_status(job_id=None):
+    if not job_id:
+        return {"status": "error", "message": "Missing job_id"}
+
+    status = frappe.cache().get_value(_job_status_key(job_id))
+    if not status:
+        return {"status": "error", "message": "Unknown or expired job"}
+
+    return {"job_id": job_id, **status}
+
+
+################################################################################
+#########################  Helper — Idempotency Keys ###########################
+################################################################################
+
+# Write endpoints accept an `Idempotency-Key` header (or `idempotency_key` in
+# the body). The first successful response is stored in Redis under that key,
+# scoped to the caller, and replayed to retries with the same payload;
+# concurrent duplicates wait on a Redis lock meanwhile.
+IDEMPOTENCY_TTL              = 24 * 3600
+IDEMPOTENCY_LOCK_TIMEOUT     = 120
+IDEMPOTENCY_BUSY_MESSAGE     = "A request with this idempotency key is still being processed"
+IDEMPOTENCY_CONFLICT_MESSAGE = "This idempotency key was already used with a different payload"
+# Not part of the payload hash: transport fields that may differ between retries
+IDEMPOTENCY_IGNORED_FIELDS   = ("idempotency_key", "token", "cmd")
+
+
+def get_idempotency_key(data=None):
+    key = frappe.get_request_header("Idempotency-Key") if frappe.request else None
+    key = key or (data or {}).get("idempotency_key")
+    return str(key).strip()[:128] if key else None
+
+
+def _is_error_response(response):
+    return not isinstance(response, dict) or bool(
+        response.get("error") or response.get("status") == "error" or response.get("success") is False
+    )
+
+
+def _idempotency_payload_hash(payload):
+    payload = {k: v for k, v in (payload or {}).items() if k not in IDEMPOTENCY_IGNORED_FIELDS}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _replay_idempotent(stored, payload_hash, error_response):
+    if stored["payload_hash"] != payload_hash:
+        return error_response(IDEMPOTENCY_CONFLICT_MESSAGE)
+    return stored["response"]
+
+
+def run_idempotent(endpoint, key, fn, error_response, scope=None, payload=None):
+    """
+    Runs `fn()` once per (endpoint, scope, key) and returns its response. `scope`
+    is the caller (user or customer) so two callers never share a key, and a key
+    reused with a different `payload` is rejected. Error responses are not
+    stored, so a retry after a failure runs again. Without a key this is just
+    `fn()`. `error_response(message)` builds the endpoint's error response.
+    """
+    if not key:
+        return fn()
+
+    cache        = frappe.cache()
+    cache_key    = f"mobile_app:idempotency:{endpoint}:{scope or ''}:{key}"
+    payload_hash = _idempotency_payload_hash(payload)
+
+    # expires=True keeps the value out of the request-local cache, so the
+    # second read below really goes back to Redis
+    stored = cache.get_value(cache_key, expires=True)
+    if stored is not None:
+        return _replay_idempotent(stored, payload_hash, error_response)
+
+    lock = cache.lock(
+        cache.make_key(f"{cache_key}:lock"),
+        timeout=IDEMPOTENCY_LOCK_TIMEOUT,
+        blocking_timeout=IDEMPOTENCY_LOCK_TIMEOUT
+    )
+    if not lock.acquire():
+        return error_response(IDEMPOTENCY_BUSY_MESSAGE)
+
+    try:
+        stored = cache.get_value(cache_key, expires=True)
+        if stored is not None:
+            return _replay_idempotent(stored, payload_hash, error_response)
+
+        response = fn()
+        if not _is_error_response(response):
+            cache.set_value(
+                cache_key, {"payload_hash": payload_hash, "response": response}, expires_in_sec=IDEMPOTENCY_TTL
+            )
+        return response
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            # The lock expired while fn() was running; another request may own it now
+            pass
+
+
+################################################################################
+#######################  Helper — Read-Only Projections ########################
+################################################################################
+
+# Detail endpoints read a handful of columns: fetching them directly avoids
+# frappe.get_doc loading every field and child table and running controller setup.
+
+def get_parent_projection(doctype, name, fields):
+    """Returns the `fields` of document `name` as a frappe._dict, or None if it does not exist."""
+    if not name:
+        return None
+    return frappe.db.get_value(doctype, name, fields, as_dict=True)
+
+
+def get_child_projection(doctype, name, child_doctype, fields, parentfield="items"):
+    """Returns the `fields` of the `parentfield` rows of document `name`, in idx order."""
+    return frappe.get_all(
+        child_doctype,
+        filters={"parent": name, "parenttype": doctype, "parentfield": parentfield},
+        fields=fields,
+        order_by="idx asc",
+        ignore_permissions=True
+    )
+
+
+################################################################################
+#########################  Helper — Image Variants #############################
+################################################################################
+
+# Resized, recompressed copies of attached images, written next to the original
+# by mobile_app.tasks.generate_image_variants: "/files/banner.png" gets
+# "/files/banner.thumb.webp" and "/files/banner.screen.webp" (".jpg" when the
+# Pillow build has no WebP support). Widths are maxima; images are never upscaled.
+# Only public files get variants: a file under /private/files is served through
+# its File record, which a generated variant does not have.
+# The variants of each file are recorded in a Redis hash (file_url -> {variant: url})
+# so catalog rows never stat the filesystem. A file missing from the hash (variants
+# generated before it existed, or a flushed cache) is probed once and recorded.
+IMAGE_VARIANTS        = {"thumb": 320, "screen": 1080}
+IMAGE_VARIANT_FORMATS = ("webp", "jpg")
+IMAGE_VARIANTS_KEY    = "mobile_app:image_variants"
+
+
+def get_public_file_path(file_url):
+    """Filesystem path of a public site file URL (/files/...), or None."""
+    if not file_url:
+        return None
+    if file_url.startswith("/files/"):
+        return frappe.get_site_path("public", "files", file_url[len("/files/"):])
+    return None
+
+
+def image_variant_url(file_url, variant, extension):
+    return f"{os.path.splitext(file_url)[0]}.{variant}.{extension}"
+
+
+def get_image_variants(file_urls):
+    """
+    Returns {file_url: {variant: url}} for the generated variants of public
+    `file_urls`, read from the Redis record in one round trip.
+    """
+    file_urls = list({url for url in file_urls if get_public_file_path(url)})
+    if not file_urls:
+        return {}
+
+    cache  = frappe.cache()
+    key    = cache.make_key(IMAGE_VARIANTS_KEY)
+    stored = cache.hmget(key, file_urls)
+
+    variants = {}
+    probed   = {}
+    for file_url, value in zip(file_urls, stored, strict=True):
+        if value is None:
+            variants[file_url] = probed[file_url] = _probe_image_variants(file_url)
+        else:
+            variants[file_url] = pickle.loads(value)
+
+    if probed:
+        # HSETNX: a probe must not overwrite what generate_image_variants just recorded
+        pipe = cache.pipeline(transaction=False)
+        for file_url, found in probed.items():
+            pipe.hsetnx(key, file_url, pickle.dumps(found))
+        pipe.execute()
+    return variants
+
+
+def _probe_image_variants(file_url):
+    path     = get_public_file_path(file_url)
+    variants = {}
+    for variant in IMAGE_VARIANTS:
+        for extension in IMAGE_VARIANT_FORMATS:
+            if os.path.exists(image_variant_url(path, variant, extension)):
+                variants[variant] = image_variant_url(file_url, variant, extension)
+                break
+    return variants
+
+
+def record_image_variants(file_url, variants):
+    """Records {variant: url} as the generated variants of `file_url`."""
+    frappe.cache().hset(IMAGE_VARIANTS_KEY, file_url, variants)
+
+
+def enqueue_image_variants(file_url, refresh_catalog=False):
+    """Generates the variants of `file_url` in the background once the transaction commits."""
+    if not get_public_file_path(file_url):
+        return
+    frappe.enqueue(
+        "mobile_app.tasks.generate_image_variants",
+        queue="long",
+        job_id=f"mobile_app_image_variants::{file_url}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        file_url=file_url,
+        refresh_catalog=refresh_catalog,
+    )
 
 
 ################################################################################
@@ -66,6 +958,7 @@ def get_user_permissions(user):
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def hello_world(name=None):
     return {
         "message": f"Hello, {name or 'Guest'}!"
@@ -77,6 +970,7 @@ def hello_world(name=None):
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def login(email: str, password: str):
     if not email or not password:
         return {"ok": False, "error": "Missing email or password"}
@@ -97,8 +991,8 @@ def login(email: str, password: str):
                 "sid":                sid,
                 "email":              frappe.session.user,
                 "name":               full_name,
-                "allowed_companies":  allowed_companies,
-                "allowed_warehouses": allowed_warehouses,
+                "allowed_companies":  sorted(allowed_companies),
+                "allowed_warehouses": sorted(allowed_warehouses),
             }
         }
 
@@ -112,7 +1006,9 @@ def login(email: str, password: str):
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
-def get_last_stock_entries(token: str, limit: int = 20, offset: int = 0, search_text=None, status=None):
+@instrument_endpoint
+def get_last_stock_entries(token: str, limit: int = 20, offset: int = 0, search_text=None, status=None,
+                           cursor=None):
     limit  = int(limit  or 20)
     offset = int(offset or 0)
 
@@ -127,7 +1023,7 @@ def get_last_stock_entries(token: str, limit: int = 20, offset: int = 0, search_
 
     # Filter by allowed warehouse if restrictions exist
     if allowed_warehouses:
-        filters["from_warehouse"] = ["in", allowed_warehouses]
+        filters["from_warehouse"] = ["in", list(allowed_warehouses)]
 
     is_search = bool(search_text and str(search_text).strip())
     if is_search:
@@ -136,12 +1032,22 @@ def get_last_stock_entries(token: str, limit: int = 20, offset: int = 0, search_
     if status and status != "All":
         filters["workflow_state"] = status
 
+    # Opt-in keyset pagination: seek past the cursor instead of skipping `offset` rows
+    or_filters = None
+    if cursor and not is_search:
+        try:
+            or_filters = _keyset_filters(filters, "posting_date", cursor)
+        except frappe.ValidationError:
+            return {"error": "Invalid cursor"}
+        offset = 0
+
     rows = frappe.get_all(
         "Stock Entry",
         fields=["name", "posting_date", "from_warehouse",
                 "to_warehouse", "workflow_state", "docstatus"],
         filters=filters,
-        order_by="posting_date desc",
+        or_filters=or_filters,
+        order_by="posting_date desc, name desc",
         limit=20  if is_search else limit,
         start=0   if is_search else offset
     )
@@ -157,7 +1063,11 @@ def get_last_stock_entries(token: str, limit: int = 20, offset: int = 0, search_
                             "Submitted" if r.get("docstatus") == 1 else "Draft"),
         })
 
-    return {"stock_entries": out, "is_search": is_search}
+    return {
+        "stock_entries": out,
+        "is_search":     is_search,
+        "next_cursor":   None if is_search else _next_cursor(rows, "posting_date", limit),
+    }
 
 
 ################################################################################
@@ -165,6 +1075,7 @@ def get_last_stock_entries(token: str, limit: int = 20, offset: int = 0, search_
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def get_stock_entry_details_by_name(token: str, name: str):
     if not name:
         return {"error": "Missing Stock Entry name"}
@@ -173,11 +1084,13 @@ def get_stock_entry_details_by_name(token: str, name: str):
     if not user:
         return {"error": "Invalid session"}
 
-    if not frappe.db.exists("Stock Entry", name):
+    doc = get_parent_projection(
+        "Stock Entry", name,
+        ["name", "posting_date", "from_warehouse", "to_warehouse", "company", "workflow_state", "docstatus"]
+    )
+    if not doc:
         return {"error": "Stock Entry not found"}
 
-    doc = frappe.get_doc("Stock Entry", name)
-
     if doc.docstatus == 2:
         return {"error": "Stock Entry is cancelled"}
 
@@ -186,8 +1099,13 @@ def get_stock_entry_details_by_name(token: str, name: str):
     if allowed_warehouses and doc.from_warehouse and doc.from_warehouse not in allowed_warehouses:
         return {"error": "Access denied for this Stock Entry"}
 
+    rows = get_child_projection(
+        "Stock Entry", name, "Stock Entry Detail",
+        ["name", "idx", "item_name", "item_code", "s_warehouse", "t_warehouse", "qty"]
+    )
+
     items = []
-    for it in (doc.get("items") or []):
+    for it in rows:
         items.append({
             "id":             it.name or "",
             "idx":            it.idx,
@@ -216,84 +1134,113 @@ def get_stock_entry_details_by_name(token: str, name: str):
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def get_client_by_code(code=None):
     if not code:
         return {"error": "Missing client code"}
 
-    customer = frappe.get_all(
-        "Customer",
-        filters={"custom_customer_code": code},
-        fields=["name", "email_id", "mobile_no", "custom_debt", "custom_debt_date",
-                "custom_customer_code", "default_price_list"],
-        limit=1
-    )
+    customer = get_customer_by_code(code)
 
     if not customer:
         return {"error": "Customer not found"}
 
-    return {"customer": customer[0]}
+    debt = frappe.db.get_value("Customer", customer.name, CUSTOMER_DEBT_FIELDS, as_dict=True) or {}
+
+    return {"customer": {
+        "name":                 customer.name,
+        "email_id":             customer.email_id,
+        "mobile_no":            customer.mobile_no,
+        "custom_debt":          debt.get("custom_debt"),
+        "custom_debt_date":     debt.get("custom_debt_date"),
+        "custom_customer_code": customer.custom_customer_code,
+        "default_price_list":   customer.default_price_list,
+    }}
 
 
 ################################################################################
 ##################  Get Invoices By Customer Code Function #####################
 ################################################################################
 
+INVOICE_FEED_DOCTYPES = ("Sales Invoice", "POS Invoice")
+
+
 @frappe.whitelist(allow_guest=True)
-def get_invoices_by_customer_code(code=None, limit=20, offset=0, search_text=None, status=None):
+@instrument_endpoint
+def get_invoices_by_customer_code(code=None, limit=20, offset=0, search_text=None, status=None, cursor=None):
+    """
+    Returns one feed of the customer's Sales and POS invoices, newest first
+    (posting_date, name). Pages hold exactly `limit` rows; pass the returned
+    `next_cursor` back as `cursor` to seek to the next page instead of using offset.
+    """
     if not code:
         return {"error": "Missing client code"}
 
     limit  = int(limit)  if limit  else 20
     offset = int(offset) if offset else 0
 
-    customer = frappe.get_all(
-        "Customer",
-        filters={"custom_customer_code": code},
-        fields=["name"],
-        limit=1
-    )
+    customer = get_customer_by_code(code)
     if not customer:
         return {"error": "Customer not found"}
 
-    customer_name = customer[0].name
-
-    filters_sales = {"customer": customer_name}
-    filters_pos   = {"customer": customer_name, "docstatus": 1}
-
-    if search_text and str(search_text).strip():
-        q = str(search_text).strip()
-        filters_sales["name"] = ["like", f"%{q}%"]
-        filters_pos["name"]   = ["like", f"%{q}%"]
-
-    if status and status != "All":
-        filters_sales["status"] = status
-        filters_pos["status"]   = status
+    customer_name = customer.name
 
     is_search = bool(search_text and str(search_text).strip())
+    if is_search:
+        limit, offset, cursor = 20, 0, None
 
-    sales_invoices = frappe.get_all(
-        "Sales Invoice",
-        filters=filters_sales,
-        fields=["name", "posting_date", "grand_total", "outstanding_amount", "status", "is_pos"],
-        order_by="posting_date desc",
-        limit=20  if is_search else limit,
-        start=0   if is_search else offset
-    )
+    values     = {"customer": customer_name}
+    conditions = ["customer = %(customer)s"]
 
-    pos_invoices = frappe.get_all(
-        "POS Invoice",
-        filters=filters_pos,
-        fields=["name", "posting_date", "grand_total", "outstanding_amount", "status", "is_pos"],
-        order_by="posting_date desc",
-        limit=20  if is_search else limit,
-        start=0   if is_search else offset
-    )
+    if is_search:
+        values["search"] = f"%{str(search_text).strip()}%"
+        conditions.append("name LIKE %(search)s")
+
+    if status and status != "All":
+        values["status"] = status
+        conditions.append("status = %(status)s")
+
+    if cursor:
+        try:
+            values["cursor_date"], values["cursor_name"] = _decode_cursor(cursor)
+        except frappe.ValidationError:
+            return {"error": "Invalid cursor"}
+        conditions.append(
+            "(posting_date < %(cursor_date)s OR (posting_date = %(cursor_date)s AND name < %(cursor_name)s))"
+        )
+        offset = 0
+
+    # Each branch is already ordered and cut to the rows the page can need,
+    # so both use the (customer, posting_date) access path before the merge
+    branch_limit = offset + limit
+    branches = []
+    for doctype in INVOICE_FEED_DOCTYPES:
+        branch_conditions = list(conditions)
+        if doctype == "POS Invoice":
+            branch_conditions.append("docstatus = 1")
+        branches.append(f"""
+            (SELECT '{doctype}' AS doctype, name, posting_date, grand_total,
+                    outstanding_amount, status, is_pos
+             FROM `tab{doctype}`
+             WHERE {" AND ".join(branch_conditions)}
+             ORDER BY posting_date DESC, name DESC
+             LIMIT {branch_limit})
+        """)
+
+    invoices = frappe.db.sql(f"""
+        {" UNION ALL ".join(branches)}
+        ORDER BY posting_date DESC, name DESC
+        LIMIT {limit} OFFSET {offset}
+    """, values, as_dict=True)
+
+    next_cursor = None if is_search else _next_cursor(invoices, "posting_date", limit)
 
     return {
         "customer_code":  code,
         "is_search":      is_search,
-        "sales_invoices": sales_invoices,
-        "pos_invoices":   pos_invoices
+        "invoices":       invoices,
+        "sales_invoices": [inv for inv in invoices if inv.doctype == "Sales Invoice"],
+        "pos_invoices":   [inv for inv in invoices if inv.doctype == "POS Invoice"],
+        "next_cursor":    next_cursor,
     }
 
 
@@ -302,21 +1249,17 @@ def get_invoices_by_customer_code(code=None, limit=20, offset=0, search_text=Non
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def get_notification_by_customer_code(code=None):
     if not code:
         return {"error": "Missing client code"}
 
-    customer = frappe.get_all(
-        "Customer",
-        filters={"custom_customer_code": code},
-        fields=["name"],
-        limit=1
-    )
+    customer = get_customer_by_code(code)
 
     if not customer:
         return {"error": "Customer not found"}
 
-    customer_name = customer[0].name
+    customer_name = customer.name
 
     all_notification = frappe.get_all(
         "Mobile Notification",
@@ -328,86 +1271,480 @@ def get_notification_by_customer_code(code=None):
 
 
 ################################################################################
-################  Get Payments By Customer Code Function #######################
+#################  Get Notifications Feed Function #############################
 ################################################################################
 
+NOTIFICATION_FEED_MAX_LIMIT = 100
+
+
 @frappe.whitelist(allow_guest=True)
-def get_payments_by_customer_code(code=None, limit=20, offset=0, search_text=None):
+@instrument_endpoint
+def get_notifications_feed(code=None, since=None, limit=20, before=None):
+    """
+    Incremental notification feed of the customer's submitted notifications, at
+    most `limit` per page, each page ordered oldest first:
+    - first call (no cursor): the newest notifications; `next_cursor` is the head;
+    - `since`: the notifications created after that cursor. Pass the returned
+      `next_cursor` as the next `since` to poll for new ones;
+    - `before`: older history. Pass the returned `older_cursor` to go further back.
+    `unread_count` is the badge count.
+    """
     if not code:
-        return {"error": "Missing customer code"}
+        return {"error": "Missing client code"}
 
-    limit  = int(limit)  if limit  else 20
-    offset = int(offset) if offset else 0
+    limit = min(int(limit or 20), NOTIFICATION_FEED_MAX_LIMIT)
 
-    customer = frappe.get_all(
-        "Customer",
-        filters={"custom_customer_code": code},
-        fields=["name"],
-        limit=1
+    customer = get_customer_by_code(code)
+    if not customer:
+        return {"error": "Customer not found"}
+
+    filters = {"customer": customer.name, "docstatus": 1}
+
+    # Without `since` the page is read newest first from the head (or from
+    # `before`), then flipped so every page is ordered oldest first
+    descending = not since
+    cursor     = since or before
+
+    or_filters = None
+    if cursor:
+        try:
+            or_filters = _keyset_filters(filters, "creation", cursor, descending=descending)
+        except frappe.ValidationError:
+            return {"error": "Invalid cursor"}
+
+    notifications = frappe.get_all(
+        "Mobile Notification",
+        filters=filters,
+        or_filters=or_filters,
+        fields=["name", "title", "msg", "is_read", "creation"],
+        order_by="creation desc, name desc" if descending else "creation asc, name asc",
+        limit=limit
+    )
+    if descending:
+        notifications.reverse()
+
+    has_more = len(notifications) == limit
+
+    next_cursor = since
+    if notifications and not before:
+        next_cursor = _encode_cursor(notifications[-1].creation, notifications[-1].name)
+
+    older_cursor = None
+    if descending and has_more:
+        older_cursor = _encode_cursor(notifications[0].creation, notifications[0].name)
+
+    return {
+        "notifications": notifications,
+        "next_cursor":   next_cursor,
+        "older_cursor":  older_cursor,
+        "has_more":      has_more,
+        "unread_count":  _unread_notification_count(customer.name),
+    }
+
+
+@frappe.whitelist(allow_guest=True)
+@instrument_endpoint
+def mark_notifications_read(code=None, names=None, up_to=None):
+    """
+    Marks notifications of the customer as read: the given `names`, or every
+    notification up to and including the `up_to` cursor. Returns the new badge count.
+    """
+    if not code:
+        return {"error": "Missing client code"}
+
+    customer = get_customer_by_code(code)
+    if not customer:
+        return {"error": "Customer not found"}
+
+    if isinstance(names, str):
+        names = json.loads(names)
+
+    values     = {"customer": customer.name}
+    conditions = ["customer = %(customer)s", "docstatus = 1", "is_read = 0"]
+
+    if names:
+        values["names"] = tuple(names)
+        conditions.append("name IN %(names)s")
+    elif up_to:
+        try:
+            values["cursor_creation"], values["cursor_name"] = _decode_cursor(up_to)
+        except frappe.ValidationError:
+            return {"error": "Invalid cursor"}
+        conditions.append(
+            "(creation < %(cursor_creation)s OR (creation = %(cursor_creation)s AND name <= %(cursor_name)s))"
+        )
+    else:
+        return {"error": "Missing names or up_to"}
+
+    frappe.db.sql(f"""
+        UPDATE `tabMobile Notification`
+        SET is_read = 1
+        WHERE {" AND ".join(conditions)}
+    """, values)
+    frappe.db.commit()
+
+    return {"unread_count": _unread_notification_count(customer.name)}
+
+
+def _unread_notification_count(customer_name):
+    return frappe.db.count(
+        "Mobile Notification", {"customer": customer_name, "docstatus": 1, "is_read": 0}
+    )
+
+
+################################################################################
+######################  Realtime Updates Function ##############################
+################################################################################
+
+# When a Mobile Notification or Annonce mobile is submitted, a version counter in
+# Redis is bumped and an UPDATES_EVENT is pushed over socket.io to the website
+# room. Events carry no content, only the kind of update, its version and an
+# opaque per-customer channel the app compares with its own; the app then
+# re-fetches through the regular endpoints. When the socket is not connected,
+# the app calls `check_for_updates`, which compares versions and returns at once
+# (waiting inside a web worker would hold the worker for the whole wait).
+UPDATES_EVENT = "mobile_app_update"
+UPDATES_BROADCAST_CHANNEL = "*"
+ANNOUNCEMENTS_VERSION_KEY = "mobile_app:updates:announcements"
+
+
+def _notifications_version_key(customer_name):
+    return f"mobile_app:updates:notifications:{customer_name}"
+
+
+def get_updates_channel(customer_name):
+    """Opaque channel id of a customer: it cannot be derived from the customer code."""
+    key = get_encryption_key().encode()
+    return hmac.new(key, customer_name.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def _get_update_versions(customer_name):
+    cache = frappe.cache()
+    notifications, announcements = cache.mget([
+        cache.make_key(_notifications_version_key(customer_name)),
+        cache.make_key(ANNOUNCEMENTS_VERSION_KEY),
+    ])
+    return {"notifications": int(notifications or 0), "announcements": int(announcements or 0)}
+
+
+def _publish_update(kind, version_key, channel):
+    cache = frappe.cache()
+    version = cache.incr(cache.make_key(version_key))
+    frappe.publish_realtime(
+        UPDATES_EVENT,
+        {"channel": channel, "kind": kind, "version": version},
+        room=get_website_room()
     )
+
+
+def publish_notification_update(customer_name):
+    """Pushes a notifications update to one customer once the transaction commits."""
+    frappe.db.after_commit.add(lambda: _publish_update(
+        "notifications", _notifications_version_key(customer_name), get_updates_channel(customer_name)
+    ))
+
+
+def publish_announcement_update():
+    """
+    Pushes an announcements update to every customer once the transaction commits.
+    Targeting is not resolved here: customers outside it re-fetch a cached list.
+    """
+    frappe.db.after_commit.add(lambda: _publish_update(
+        "announcements", ANNOUNCEMENTS_VERSION_KEY, UPDATES_BROADCAST_CHANNEL
+    ))
+
+
+def on_notification_submit(doc, method=None):
+    """`doc_events` hook on Mobile Notification: realtime update and phone push."""
+    if doc.customer:
+        publish_notification_update(doc.customer)
+        add_to_push_outbox([{"name": doc.name, "customer": doc.customer, "title": doc.title, "msg": doc.msg}])
+
+
+@frappe.whitelist(allow_guest=True)
+@instrument_endpoint
+def check_for_updates(code=None, cursor=None):
+    """
+    Polling fallback of the realtime channel: lists the kinds of update whose
+    version differs from the ones in `cursor` (all of them without a cursor) and
+    returns the current cursor. It never waits.
+    """
+    if not code:
+        return {"error": "Missing client code"}
+
+    customer = get_customer_by_code(code)
     if not customer:
         return {"error": "Customer not found"}
 
-    customer_name = customer[0].name
+    known = None
+    if cursor:
+        try:
+            known = _decode_token(cursor)
+        except frappe.ValidationError:
+            return {"error": "Invalid cursor"}
+
+    current = _get_update_versions(customer.name)
 
-    filters = {
-        "party_type": "Customer",
-        "party":      customer_name,
-        "docstatus":  1
+    return {
+        "changed": [kind for kind, version in current.items() if known is None or known.get(kind) != version],
+        "cursor":  _encode_token(current),
+        "channel": get_updates_channel(customer.name),
+        "event":   UPDATES_EVENT,
     }
 
-    is_search = bool(search_text and str(search_text).strip())
-    if is_search:
-        filters["name"] = ["like", f"%{str(search_text).strip()}%"]
 
-    payments = frappe.get_all(
-        "Payment Entry",
-        filters=filters,
-        fields=["name", "posting_date", "paid_amount", "payment_type", "mode_of_payment"],
-        order_by="posting_date desc",
-        limit=20  if is_search else limit,
-        start=0   if is_search else offset
+################################################################################
+######################  Push Outbox Function ###################################
+################################################################################
+
+# Submitted notifications are written to the Mobile Push Outbox in the same
+# transaction, and `mobile_app.tasks.dispatch_push_outbox` drains it to the push
+# gateway in batches. The dispatcher is queued after commit and also runs every
+# minute to pick up retries. Without a gateway configured (see
+# `push_gateway_configured`) nothing is written and nothing is dispatched.
+PUSH_STATS_KEY      = "mobile_app:push:stats"
+PUSH_STATS_MINUTES  = 15
+PUSH_STUB_KEY       = "mobile_app:push:stub"
+PUSH_STUB_MAX_ITEMS = 1000
+PUSH_OUTBOX_FIELDS  = ("name", "owner", "modified_by", "creation", "modified", "customer",
+                       "notification", "title", "body", "status", "attempts", "next_attempt_at")
+
+
+def push_gateway_configured():
+    """True when site config names a gateway callable or a gateway URL."""
+    return bool(frappe.conf.get("mobile_app_push_gateway") or frappe.conf.get("mobile_app_push_url"))
+
+
+def add_to_push_outbox(notifications):
+    """Queues one push per notification, given as dicts with name, customer, title and msg."""
+    if not push_gateway_configured():
+        return
+
+    now  = frappe.utils.now()
+    user = frappe.session.user
+    frappe.db.bulk_insert(
+        "Mobile Push Outbox",
+        PUSH_OUTBOX_FIELDS,
+        [(frappe.generate_hash(length=10), user, user, now, now, notification["customer"],
+          notification["name"], notification["title"], notification["msg"], "Pending", 0, now)
+         for notification in notifications],
+    )
+    frappe.enqueue(
+        "mobile_app.tasks.dispatch_push_outbox",
+        queue="short",
+        job_id="mobile_app_push_dispatch",
+        deduplicate=True,
+        enqueue_after_commit=True,
     )
 
-    if not payments:
-        return {"payments": [], "is_search": is_search}
 
-    pe_names = [p["name"] for p in payments]
+def push_stats_minute_key(minute):
+    return f"mobile_app:push:minute:{minute:%Y%m%d%H%M}"
+
+
+@frappe.whitelist()
+@instrument_endpoint
+def get_push_stats():
+    """Push throughput: totals, the last PUSH_STATS_MINUTES minutes and the outbox backlog."""
+    frappe.only_for("System Manager")
+
+    cache   = frappe.cache()
+    now     = frappe.utils.now_datetime()
+    minutes = [frappe.utils.add_to_date(now, minutes=-i) for i in range(PUSH_STATS_MINUTES)]
+
+    pipe = cache.pipeline()
+    pipe.hgetall(cache.make_key(PUSH_STATS_KEY))
+    for minute in minutes:
+        pipe.hgetall(cache.make_key(push_stats_minute_key(minute)))
+    totals, *per_minute = [
+        {field.decode(): int(value) for field, value in counters.items()} for counters in pipe.execute()
+    ]
+
+    return {
+        "totals":     totals,
+        "per_minute": [
+            {"minute": f"{minute:%Y-%m-%d %H:%M}", **counters}
+            for minute, counters in zip(minutes, per_minute, strict=True)
+        ],
+        "pending":    frappe.db.count("Mobile Push Outbox", {"status": "Pending"}),
+        "failed":     frappe.db.count("Mobile Push Outbox", {"status": "Failed"}),
+    }
 
-    refs = frappe.get_all(
-        "Payment Entry Reference",
-        filters={"parent": ["in", pe_names], "reference_doctype": "Sales Invoice"},
-        fields=["parent", "reference_name", "allocated_amount",
-                "total_amount", "outstanding_amount"],
-        order_by="parent desc"
+
+@frappe.whitelist(allow_guest=True, methods=["POST"])
+@instrument_endpoint
+def push_gateway_stub():
+    """
+    Local stand-in for a push gateway, for testing: it records the batch it receives
+    in Redis and reports every message as delivered. It only answers when
+    `mobile_app_push_stub` is set in site config.
+    """
+    if not frappe.conf.get("mobile_app_push_stub"):
+        raise frappe.PermissionError
+
+    messages = (frappe.request.get_json(silent=True) or {}).get("messages") or []
+
+    cache = frappe.cache()
+    key   = cache.make_key(PUSH_STUB_KEY)
+    pipe  = cache.pipeline()
+    for message in messages:
+        pipe.lpush(key, json.dumps(message))
+    pipe.ltrim(key, 0, PUSH_STUB_MAX_ITEMS - 1)
+    pipe.execute()
+
+    return {"failed": {}}
+
+
+################################################################################
+######################  Notification Fan-Out Function ##########################
+################################################################################
+
+@frappe.whitelist()
+@instrument_endpoint
+def fan_out_notification(title=None, msg=None, customer_group=None, territory=None, customers=None):
+    """
+    Sends one notification to a segment of customers: a customer group or a
+    territory (children included), or an explicit list of customers. The rows are
+    bulk inserted by a background job; poll `get_job_status` for its progress.
+    """
+    frappe.only_for("System Manager")
+
+    if not title or not msg:
+        return {"error": "Missing title or msg"}
+
+    if isinstance(customers, str):
+        customers = json.loads(customers)
+
+    if not (customer_group or territory or customers):
+        return {"error": "Missing customer_group, territory or customers"}
+
+    customers = get_segment_customers(customer_group, territory, customers)
+    if not customers:
+        return {"error": "No customer in this segment"}
+
+    fanout_id = frappe.generate_hash(length=8)
+    job_id = enqueue_mobile_job(
+        "mobile_app.tasks.fan_out_notification",
+        queue="long",
+        title=title,
+        msg=msg,
+        customers=customers,
+        fanout_id=fanout_id,
     )
+    return {"status": "queued", "job_id": job_id, "fanout_id": fanout_id, "customers": len(customers)}
 
-    invoice_names = list({r["reference_name"] for r in refs})
-    invoice_map = {}
-    if invoice_names:
-        invoices = frappe.get_all(
-            "Sales Invoice",
-            filters={"name": ["in", invoice_names]},
-            fields=["name", "posting_date", "status", "grand_total", "outstanding_amount"],
-        )
-        invoice_map = {inv["name"]: inv for inv in invoices}
-
-    refs_by_payment = {}
-    for r in refs:
-        inv = invoice_map.get(r["reference_name"], {})
-        refs_by_payment.setdefault(r["parent"], []).append({
-            "invoice":              r["reference_name"],
-            "allocated_amount":     r.get("allocated_amount"),
-            "invoice_posting_date": inv.get("posting_date"),
-            "invoice_status":       inv.get("status"),
-            "invoice_total":        inv.get("grand_total"),
-            "invoice_outstanding":  inv.get("outstanding_amount"),
-        })
 
-    for p in payments:
-        p["invoices_payed"] = refs_by_payment.get(p["name"], [])
+def get_segment_customers(customer_group=None, territory=None, customers=None):
+    """Names of the enabled customers matching every given segment criterion."""
+    filters = {"disabled": 0}
+    if customer_group:
+        filters["customer_group"] = ["in", [customer_group, *frappe.db.get_descendants("Customer Group", customer_group)]]
+    if territory:
+        filters["territory"] = ["in", [territory, *frappe.db.get_descendants("Territory", territory)]]
+    if customers:
+        filters["name"] = ["in", list(customers)]
 
-    return {"payments": payments, "is_search": is_search}
+    return frappe.get_all("Customer", filters=filters, pluck="name", order_by="name asc")
+
+
+################################################################################
+################  Get Payments By Customer Code Function #######################
+################################################################################
+
+@frappe.whitelist(allow_guest=True)
+@instrument_endpoint
+def get_payments_by_customer_code(code=None, limit=20, offset=0, search_text=None, cursor=None):
+    """
+    Returns the customer's submitted payments, newest first, each with the Sales
+    Invoices it was allocated to. The page and its allocations come from a single
+    joined query; pass the returned `next_cursor` back as `cursor` for the next page.
+    """
+    if not code:
+        return {"error": "Missing customer code"}
+
+    limit  = int(limit)  if limit  else 20
+    offset = int(offset) if offset else 0
+
+    customer = get_customer_by_code(code)
+    if not customer:
+        return {"error": "Customer not found"}
+
+    values     = {"party": customer.name}
+    conditions = ["party_type = 'Customer'", "party = %(party)s", "docstatus = 1"]
+
+    is_search = bool(search_text and str(search_text).strip())
+    if is_search:
+        limit, offset = 20, 0
+        values["search"] = f"%{str(search_text).strip()}%"
+        conditions.append("name LIKE %(search)s")
+
+    elif cursor:
+        try:
+            values["cursor_date"], values["cursor_name"] = _decode_cursor(cursor)
+        except frappe.ValidationError:
+            return {"error": "Invalid cursor"}
+        conditions.append(
+            "(posting_date < %(cursor_date)s OR (posting_date = %(cursor_date)s AND name < %(cursor_name)s))"
+        )
+        offset = 0
+
+    # The page of payments is cut in the derived table first, so the joins
+    # only touch the allocations of the rows actually returned
+    rows = frappe.db.sql(f"""
+        SELECT
+            pe.name, pe.posting_date, pe.paid_amount, pe.payment_type, pe.mode_of_payment,
+            ref.reference_name      AS invoice,
+            ref.allocated_amount    AS allocated_amount,
+            si.posting_date         AS invoice_posting_date,
+            si.status               AS invoice_status,
+            si.grand_total          AS invoice_total,
+            si.outstanding_amount   AS invoice_outstanding
+        FROM (
+            SELECT name, posting_date, paid_amount, payment_type, mode_of_payment
+            FROM `tabPayment Entry`
+            WHERE {" AND ".join(conditions)}
+            ORDER BY posting_date DESC, name DESC
+            LIMIT {limit} OFFSET {offset}
+        ) pe
+        LEFT JOIN `tabPayment Entry Reference` ref
+            ON  ref.parent            = pe.name
+            AND ref.parenttype        = 'Payment Entry'
+            AND ref.reference_doctype = 'Sales Invoice'
+        LEFT JOIN `tabSales Invoice` si
+            ON  si.name = ref.reference_name
+        ORDER BY pe.posting_date DESC, pe.name DESC, ref.idx ASC
+    """, values, as_dict=True)
+
+    payments = []
+    by_name  = {}
+    for r in rows:
+        payment = by_name.get(r.name)
+        if payment is None:
+            payment = by_name[r.name] = frappe._dict({
+                "name":            r.name,
+                "posting_date":    r.posting_date,
+                "paid_amount":     r.paid_amount,
+                "payment_type":    r.payment_type,
+                "mode_of_payment": r.mode_of_payment,
+                "invoices_payed":  [],
+            })
+            payments.append(payment)
+
+        if r.invoice:
+            payment.invoices_payed.append({
+                "invoice":              r.invoice,
+                "allocated_amount":     r.allocated_amount,
+                "invoice_posting_date": r.invoice_posting_date,
+                "invoice_status":       r.invoice_status,
+                "invoice_total":        r.invoice_total,
+                "invoice_outstanding":  r.invoice_outstanding,
+            })
+
+    return {
+        "payments":    payments,
+        "is_search":   is_search,
+        "next_cursor": None if is_search else _next_cursor(payments, "posting_date", limit),
+    }
 
 
 ################################################################################
@@ -415,21 +1752,28 @@ def get_payments_by_customer_code(code=None, limit=20, offset=0, search_text=Non
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def get_single_invoice_details(invoice_name=None):
     try:
         if not invoice_name:
             return {"error": "Missing invoice name"}
 
+        invoice_fields = ["name", "posting_date", "grand_total", "outstanding_amount", "status"]
+
         invoice_type = "Sales Invoice"
-        if not frappe.db.exists(invoice_type, invoice_name):
+        doc = get_parent_projection(invoice_type, invoice_name, invoice_fields)
+        if not doc:
             invoice_type = "POS Invoice"
-            if not frappe.db.exists(invoice_type, invoice_name):
+            doc = get_parent_projection(invoice_type, invoice_name, invoice_fields)
+            if not doc:
                 return {"error": "Invoice not found"}
 
-        doc = frappe.get_doc(invoice_type, invoice_name)
+        rows = get_child_projection(
+            invoice_type, invoice_name, f"{invoice_type} Item", ["item_code", "qty", "rate", "amount"]
+        )
 
         items = []
-        for item in doc.items:
+        for item in rows:
             items.append({
                 "item_code": item.item_code or "",
                 "qty":       float(item.qty or 0),
@@ -459,6 +1803,7 @@ def get_single_invoice_details(invoice_name=None):
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def manage_stock_entry(name=None, items=None, action="save"):
     try:
         token = None
@@ -536,6 +1881,7 @@ def manage_stock_entry(name=None, items=None, action="save"):
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def search_items(search_text=None, customer_code=None):
 
     if not search_text:
@@ -549,54 +1895,182 @@ def search_items(search_text=None, customer_code=None):
     if not re.match(r'^[\w\s\-\.+]+$', search_text, re.UNICODE):
         return {"status": "error", "message": "Unauthorized characters in search text"}
 
-    items = frappe.get_all(
+    items = None
+    if frappe.conf.get("mobile_app_typeahead"):
+        items = search_typeahead_index(search_text, limit=10)
+    if not items:
+        items = _search_item_rows(search_text, limit=10)
+
+    if not items:
+        return []
+
+    price_list = FALLBACK_PRICE_LIST
+    if customer_code:
+        customer = get_customer_by_code(customer_code)
+        if customer and customer.default_price_list:
+            price_list = customer.default_price_list
+
+    price_map = get_price_map(price_list)
+
+    for item in items:
+        item["standard_rate"] = flt(price_map.get(item["item_code"], 0.0))
+
+    return items
+
+
+# FULLTEXT index installed by patches/v1_0/add_item_search_index. InnoDB does not
+# index words shorter than innodb_ft_min_token_size (3 by default).
+ITEM_SEARCH_INDEX  = "mobile_app_item_search"
+FULLTEXT_MIN_TOKEN = 3
+
+
+def _search_item_rows(search_text, limit=10):
+    """
+    Returns up to `limit` enabled sales items matching `search_text`, best first:
+    exact code, then code prefix, then FULLTEXT relevance. Terms too short for
+    the FULLTEXT index (or no FULLTEXT hit) fall back to an indexed prefix search.
+    """
+    terms = re.findall(r"\w+", search_text, re.UNICODE)
+
+    if frappe.db.db_type == "mariadb" and terms and all(len(t) >= FULLTEXT_MIN_TOKEN for t in terms):
+        against = " ".join(f"+{t}*" for t in terms)
+        items = frappe.db.sql(f"""
+            SELECT item_code, item_name
+            FROM `tabItem`
+            WHERE disabled = 0
+              AND is_sales_item = 1
+              AND MATCH(item_code, item_name) AGAINST (%(against)s IN BOOLEAN MODE)
+            ORDER BY
+              item_code = %(text)s DESC,
+              item_code LIKE %(prefix)s DESC,
+              MATCH(item_code, item_name) AGAINST (%(against)s IN BOOLEAN MODE) DESC,
+              item_code
+            LIMIT {int(limit)}
+        """, {"against": against, "text": search_text, "prefix": f"{search_text}%"}, as_dict=True)
+        if items:
+            return items
+
+    return frappe.get_all(
         "Item",
         filters={"disabled": 0, "is_sales_item": 1},
         or_filters={
-            "item_code": ["like", f"%{search_text}%"],
-            "item_name": ["like", f"%{search_text}%"]
+            "name":      ["like", f"{search_text}%"],
+            "item_name": ["like", f"{search_text}%"]
         },
         fields=["item_code", "item_name"],
-        limit=10
+        order_by="item_code asc",
+        limit=limit
+    )
+
+
+################################################################################
+#####################  Helper — Item Typeahead Index ###########################
+################################################################################
+
+# Optional in-process index (site config `mobile_app_typeahead: 1`). Each worker
+# keeps a sorted array of normalized item codes, names and name words, rebuilt
+# when the Redis version stamp is bumped by the Item hooks.
+ITEM_INDEX_VERSION_KEY = "mobile_app:item_index_version"
+TYPEAHEAD_MAX_SCAN     = 200
+
+_typeahead_indexes = {}
+
+
+def _normalize_search_text(text):
+    text = unicodedata.normalize("NFKD", str(text or "").lower())
+    return " ".join("".join(c for c in text if not unicodedata.combining(c)).split())
+
+
+def _get_typeahead_index():
+    cache   = frappe.cache()
+    version = int(cache.get(cache.make_key(ITEM_INDEX_VERSION_KEY)) or 0)
+
+    index = _typeahead_indexes.get(frappe.local.site)
+    if index and index["version"] == version:
+        return index
+
+    items = frappe.get_all(
+        "Item",
+        filters={"disabled": 0, "is_sales_item": 1},
+        fields=["item_code", "item_name"]
     )
 
-    if not items:
+    entries    = set()
+    names      = {}
+    norm_codes = {}
+    search     = {}
+    for item in items:
+        code      = item.item_code
+        norm_code = _normalize_search_text(code)
+        norm_name = _normalize_search_text(item.item_name)
+
+        names[code]      = item.item_name
+        norm_codes[code] = norm_code
+        search[code]     = f"{norm_code} {norm_name}"
+
+        entries.add((norm_code, code))
+        entries.add((norm_name, code))
+        for word in norm_name.split()[1:]:
+            entries.add((word, code))
+
+    entries = sorted(entries)
+    index = {
+        "version":    version,
+        "keys":       [key for key, _ in entries],
+        "codes":      [code for _, code in entries],
+        "names":      names,
+        "norm_codes": norm_codes,
+        "search":     search,
+    }
+    _typeahead_indexes[frappe.local.site] = index
+    return index
+
+
+def search_typeahead_index(search_text, limit=10):
+    """
+    Answers a typeahead query from the in-process index: items having a code,
+    name or name word starting with the first term and containing every other
+    term. Returns [] when nothing matches so the caller can fall back to the DB.
+    """
+    terms = _normalize_search_text(search_text).split()
+    if not terms:
         return []
 
-    price_list = "Public - Alger"
-    if customer_code:
-        customer_price_list = frappe.db.get_value(
-            "Customer",
-            {"custom_customer_code": customer_code},
-            "default_price_list"
-        )
-        if customer_price_list:
-            price_list = customer_price_list
+    index = _get_typeahead_index()
+    keys  = index["keys"]
+    first = terms[0]
+
+    matches = []
+    seen    = set()
+    i = bisect.bisect_left(keys, first)
+    while i < len(keys) and keys[i].startswith(first) and len(seen) < TYPEAHEAD_MAX_SCAN:
+        code = index["codes"][i]
+        i += 1
+        if code in seen:
+            continue
+        seen.add(code)
+        if all(term in index["search"][code] for term in terms[1:]):
+            matches.append(code)
 
-    item_codes = [item["item_code"] for item in items]
+    query      = " ".join(terms)
+    norm_codes = index["norm_codes"]
+    matches.sort(key=lambda code: (norm_codes[code] != query, not norm_codes[code].startswith(first), code))
 
-    prices_raw = frappe.get_all(
-        "Item Price",
-        filters={"item_code": ["in", item_codes], "price_list": price_list, "selling": 1},
-        fields=["item_code", "price_list_rate"]
-    )
-    price_map = {p["item_code"]: p["price_list_rate"] for p in prices_raw}
+    return [{"item_code": code, "item_name": index["names"][code]} for code in matches[:limit]]
 
-    fallback_map = {}
-    if price_list != "Public - Alger":
-        fallback_raw = frappe.get_all(
-            "Item Price",
-            filters={"item_code": ["in", item_codes], "price_list": "Public - Alger", "selling": 1},
-            fields=["item_code", "price_list_rate"]
-        )
-        fallback_map = {p["item_code"]: p["price_list_rate"] for p in fallback_raw}
 
-    for item in items:
-        code = item["item_code"]
-        rate = price_map.get(code) or fallback_map.get(code)
-        item["standard_rate"] = flt(rate) if rate else 0.0
+def _bump_item_index_version():
+    cache = frappe.cache()
+    cache.incr(cache.make_key(ITEM_INDEX_VERSION_KEY))
 
-    return items
+
+def on_item_change(doc, method=None):
+    """`doc_events` hook on Item: invalidate the typeahead indexes and catalog snapshots."""
+    frappe.db.after_commit.add(_bump_item_index_version)
+    enqueue_catalog_snapshots()
+
+    if doc.get("image") and method == "on_update" and doc.has_value_changed("image"):
+        enqueue_image_variants(doc.image, refresh_catalog=True)
 
 
 ################################################################################
@@ -604,19 +2078,74 @@ def search_items(search_text=None, customer_code=None):
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def get_announcements_by_customer_code(code=None, limit=10, offset=0):
+    """
+    Returns the live announcements a customer may see: not in the `banned`
+    table, and either with an empty `allowed` table or listed in it. Filtering
+    runs in memory over the cached set of today's active announcements.
+    """
     if not code:
         return {"error": "Missing client code"}
 
     limit        = int(limit)
     offset       = int(offset)
-    current_date = frappe.utils.today()
 
-    customer_name = frappe.db.get_value("Customer", {"custom_customer_code": code}, "name")
-    if not customer_name:
+    customer = get_customer_by_code(code)
+    if not customer:
         return {"error": "Customer not found"}
 
-    all_announcements = frappe.get_all(
+    customer_name = customer.name
+
+    valid_announcements = [
+        ann["row"] for ann in get_active_announcements()
+        if customer_name not in ann["banned"] and (not ann["allowed"] or customer_name in ann["allowed"])
+    ]
+
+    page     = valid_announcements[offset: offset + limit]
+    variants = get_image_variants(row["image"] for row in page)
+
+    return {
+        "customer":      customer_name,
+        "total_count":   len(valid_announcements),
+        "announcements": [{**row, "image_variants": variants.get(row["image"], {})} for row in page],
+    }
+
+
+################################################################################
+#####################  Helper — Active Announcements Cache #####################
+################################################################################
+
+# The live set only changes when an Annonce mobile is submitted, cancelled or
+# updated after submit, or when the date changes; the key carries the date so a
+# new day never reads yesterday's set, and a daily job pre-builds it at midnight.
+ACTIVE_ANNOUNCEMENTS_TTL = 2 * 24 * 3600
+
+
+def _active_announcements_key(date=None):
+    return f"mobile_app:active_announcements:{date or frappe.utils.today()}"
+
+
+def get_active_announcements():
+    """
+    Returns today's submitted announcements, newest first, as dicts holding the
+    API `row` and the `allowed` / `banned` customer frozensets.
+    The worker-local copy is keyed on ANNOUNCEMENTS_VERSION_KEY: the version is
+    bumped after the rebuild, so a client re-fetching on the realtime event never
+    gets a worker's older copy.
+    """
+    cache        = frappe.cache()
+    current_date = frappe.utils.today()
+    return _get_cached(
+        _active_announcements_key(current_date),
+        lambda: _build_active_announcements(current_date),
+        expires_in_sec=ACTIVE_ANNOUNCEMENTS_TTL,
+        version=cache.get(cache.make_key(ANNOUNCEMENTS_VERSION_KEY))
+    )
+
+
+def _build_active_announcements(current_date):
+    announcements = frappe.get_all(
         "Annonce mobile",
         filters=[
             ["docstatus",    "=",  1],
@@ -625,40 +2154,63 @@ def get_announcements_by_customer_code(code=None, limit=10, offset=0):
         ],
         fields=["name", "title", "announcement_typ", "priority", "color",
                 "description", "banner_image", "publish_date"],
-        order_by="publish_date desc",
+        order_by="publish_date desc, name desc",
         ignore_permissions=True
     )
+    if not announcements:
+        return []
+
+    targets = {}
+    for row in frappe.get_all(
+        "Mobile Announcement Customer",
+        filters={
+            "parent":      ["in", [ann.name for ann in announcements]],
+            "parenttype":  "Annonce mobile",
+            "parentfield": ["in", ["allowed", "banned"]],
+        },
+        fields=["parent", "parentfield", "customer"],
+        ignore_permissions=True
+    ):
+        targets.setdefault((row.parent, row.parentfield), set()).add(row.customer)
+
+    return [
+        {
+            "row":     _announcement_row(ann),
+            "allowed": frozenset(targets.get((ann.name, "allowed"), ())),
+            "banned":  frozenset(targets.get((ann.name, "banned"), ())),
+        }
+        for ann in announcements
+    ]
 
-    valid_announcements = []
 
-    for ann in all_announcements:
-        doc = frappe.get_doc("Annonce mobile", ann.name, ignore_permissions=True)
+def rebuild_active_announcements():
+    """Drops and rebuilds today's active announcements cache."""
+    _invalidate_cached(_active_announcements_key())
+    get_active_announcements()
 
-        is_banned = any(row.customer == customer_name for row in doc.get("banned", []))
-        if is_banned:
-            continue
 
-        allowed_list = doc.get("allowed", [])
-        is_allowed = not allowed_list or any(row.customer == customer_name for row in allowed_list)
-
-        if is_allowed:
-            valid_announcements.append({
-                "id":         ann.name,
-                "title":      ann.title,
-                "subtitle":   ann.description or "",
-                "type":       ann.announcement_typ or "Info",
-                "priority":   ann.priority or "Medium",
-                "color":      ann.color or "#00A89C",
-                "postedTime": str(ann.publish_date or ""),
-                "image":      ann.banner_image,
-            })
+def on_announcement_change(doc, method=None):
+    """
+    `doc_events` hook on Annonce mobile: rebuild the active set once the transaction
+    commits, then bump the announcements version (callbacks run in that order).
+    """
+    frappe.db.after_commit.add(rebuild_active_announcements)
+    publish_announcement_update()
+
+    if method == "on_submit" and doc.get("banner_image"):
+        enqueue_image_variants(doc.banner_image)
 
-    paginated_list = valid_announcements[offset: offset + limit]
 
+def _announcement_row(ann):
     return {
-        "customer":      customer_name,
-        "total_count":   len(valid_announcements),
-        "announcements": paginated_list
+        "id":         ann.name,
+        "title":      ann.title,
+        "subtitle":   ann.description or "",
+        "type":       ann.announcement_typ or "Info",
+        "priority":   ann.priority or "Medium",
+        "color":      ann.color or "#00A89C",
+        "postedTime": str(ann.publish_date or ""),
+        "image":      ann.banner_image,
     }
 
 
@@ -666,73 +2218,232 @@ def get_announcements_by_customer_code(code=None, limit=10, offset=0):
 ######################  Get Items By Customer Code Function ####################
 ################################################################################
 
+CATALOG_ITEM_FIELDS = ["item_code", "item_name", "description", "item_group", "stock_uom", "image"]
+
+
 @frappe.whitelist(allow_guest=True)
-def get_items_by_customer_code(customer_code):
+@instrument_endpoint
+def get_items_by_customer_code(customer_code, since=None):
+    """
+    Returns the sales catalog of a customer with its effective prices.
+    Every response carries a `sync_token`; passing it back as `since` returns
+    only the items whose row or price changed after it, plus the codes of the
+    items that were deleted, disabled or withdrawn from sale in `removed`.
+    Deltas overlap by CATALOG_SYNC_SAFETY_WINDOW: clients upsert rows by item_code.
+    """
     try:
         if not customer_code:
             return {"status": "error", "message": "Missing customer_code"}
 
-        price_list = frappe.db.get_value(
-            "Customer",
-            {"custom_customer_code": customer_code},
-            "default_price_list"
-        ) or "Public - Alger"
+        customer   = get_customer_by_code(customer_code)
+        price_list = (customer.default_price_list if customer else None) or FALLBACK_PRICE_LIST
 
-        items = frappe.get_all(
-            "Item",
-            filters={"disabled": 0, "is_sales_item": 1},
-            fields=["item_code", "item_name", "description", "item_group", "stock_uom"]
-        )
+        # Taken before reading any row so changes made meanwhile show up in the next delta
+        sync_token = _encode_token({"price_list": price_list, "modified": _get_catalog_watermark()})
 
-        if not items:
-            return {"status": "success", "price_list": price_list, "items": []}
+        since_modified = None
+        if since:
+            try:
+                token = _decode_token(since)
+            except frappe.ValidationError:
+                return {"status": "error", "message": "Invalid since token"}
+            # A token issued for another price list cannot be patched: send everything
+            if token.get("price_list") == price_list:
+                since_modified = token.get("modified")
 
-        item_codes = [item["item_code"] for item in items]
-
-        customer_prices_raw = frappe.get_all(
-            "Item Price",
-            filters={"item_code": ["in", item_codes], "price_list": price_list, "selling": 1},
-            fields=["item_code", "price_list_rate"]
-        )
-        customer_price_map = {p["item_code"]: p["price_list_rate"] for p in customer_prices_raw}
-
-        fallback_price_map = {}
-        if price_list != "Public - Alger":
-            fallback_prices_raw = frappe.get_all(
-                "Item Price",
-                filters={"item_code": ["in", item_codes], "price_list": "Public - Alger", "selling": 1},
-                fields=["item_code", "price_list_rate"]
-            )
-            fallback_price_map = {p["item_code"]: p["price_list_rate"] for p in fallback_prices_raw}
+        if not since_modified:
+            return build_catalog_payload(price_list, sync_token)
 
-        result = []
-        for item in items:
-            code = item["item_code"]
-            rate = customer_price_map.get(code) or fallback_price_map.get(code) or 0.0
-            result.append({
-                "item_code":   code,
-                "item_name":   item["item_name"],
-                "description": item.get("description") or "",
-                "item_group":  item.get("item_group") or "",
-                "uom":         item.get("stock_uom") or "Nos",
-                "rate":        float(rate),
-                "currency":    "DZD",
-                "price_list":  price_list
-            })
+        items, removed = _get_catalog_changes(price_list, since_modified)
+        price_map = get_price_map(price_list) if items else {}
+        variants  = get_image_variants(item.get("image") for item in items)
 
-        return {"status": "success", "price_list": price_list, "items": result}
+        return {
+            "status":     "success",
+            "price_list": price_list,
+            "items":      [_catalog_item_row(item, price_list, price_map, variants) for item in items],
+            "removed":    removed,
+            "is_delta":   True,
+            "sync_token": sync_token,
+        }
 
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), "Error get_items")
         return {"status": "error", "message": str(e)}
 
 
+def build_catalog_payload(price_list, sync_token=None):
+    """Full catalog response for a price list; also the content of catalog snapshots."""
+    if not sync_token:
+        sync_token = _encode_token({"price_list": price_list, "modified": _get_catalog_watermark()})
+
+    items = frappe.get_all(
+        "Item",
+        filters={"disabled": 0, "is_sales_item": 1},
+        fields=CATALOG_ITEM_FIELDS
+    )
+    price_map = get_price_map(price_list) if items else {}
+    variants  = get_image_variants(item.get("image") for item in items)
+
+    return {
+        "status":     "success",
+        "price_list": price_list,
+        "items":      [_catalog_item_row(item, price_list, price_map, variants) for item in items],
+        "removed":    [],
+        "is_delta":   False,
+        "sync_token": sync_token,
+    }
+
+
+def _catalog_item_row(item, price_list, price_map, variants):
+    code = item["item_code"]
+    return {
+        "item_code":   code,
+        "item_name":   item["item_name"],
+        "description": item.get("description") or "",
+        "item_group":  item.get("item_group") or "",
+        "uom":         item.get("stock_uom") or "Nos",
+        "image":       item.get("image") or "",
+        "image_variants": variants.get(item.get("image"), {}),
+        "rate":        float(price_map.get(code, 0.0)),
+        "currency":    "DZD",
+        "price_list":  price_list
+    }
+
+
+# `modified` is stamped when a row is saved, not when its transaction commits,
+# so a row committed after a token was issued can carry an older timestamp.
+# Tokens therefore point CATALOG_SYNC_SAFETY_WINDOW seconds before the latest
+# change: rows in that window are sent again and the client upserts them by
+# item_code, but a late commit is not skipped.
+CATALOG_SYNC_SAFETY_WINDOW = 600
+
+
+def _get_catalog_watermark():
+    """Latest modification (or deletion) time across Item and Item Price, minus the safety window."""
+    watermark = frappe.db.sql("""
+        SELECT GREATEST(
+            COALESCE((SELECT MAX(modified) FROM `tabItem`),       '1900-01-01'),
+            COALESCE((SELECT MAX(modified) FROM `tabItem Price`), '1900-01-01'),
+            COALESCE((SELECT MAX(creation) FROM `tabDeleted Document`
+                      WHERE deleted_doctype IN ('Item', 'Item Price')), '1900-01-01')
+        ) - INTERVAL %s SECOND
+    """, (CATALOG_SYNC_SAFETY_WINDOW,))[0][0]
+    return str(watermark)
+
+
+def _get_catalog_changes(price_list, since_modified):
+    """Returns (item rows to upsert, item codes to remove) since `since_modified`."""
+    price_lists = list({price_list, FALLBACK_PRICE_LIST})
+
+    # Rows are compared with >= so nothing written in the same second as the
+    # watermark is lost; the client simply receives those rows twice.
+    changed = frappe.get_all(
+        "Item",
+        filters={"modified": [">=", since_modified]},
+        fields=[*CATALOG_ITEM_FIELDS, "disabled", "is_sales_item"]
+    )
+
+    repriced = set(frappe.get_all(
+        "Item Price",
+        filters={"modified": [">=", since_modified], "price_list": ["in", price_lists]},
+        pluck="item_code"
+    ))
+
+    removed = set()
+    deleted = frappe.get_all(
+        "Deleted Document",
+        filters={"deleted_doctype": ["in", ["Item", "Item Price"]], "creation": [">=", since_modified]},
+        fields=["deleted_doctype", "deleted_name", "data"]
+    )
+    for d in deleted:
+        if d.deleted_doctype == "Item":
+            removed.add(d.deleted_name)
+            continue
+        data = json.loads(d.data or "{}")
+        if data.get("price_list") in price_lists and data.get("item_code"):
+            repriced.add(data["item_code"])
+
+    repriced -= {item.item_code for item in changed} | removed
+    if repriced:
+        changed = [*changed, *frappe.get_all(
+            "Item",
+            filters={"name": ["in", list(repriced)]},
+            fields=[*CATALOG_ITEM_FIELDS, "disabled", "is_sales_item"]
+        )]
+
+    items = []
+    for item in changed:
+        if item.disabled or not item.is_sales_item:
+            removed.add(item.item_code)
+        else:
+            items.append(item)
+
+    return items, sorted(removed)
+
+
+################################################################################
+######################  Get Catalog Snapshot Function ##########################
+################################################################################
+
+@frappe.whitelist(allow_guest=True)
+@instrument_endpoint
+def get_catalog_snapshot(customer_code=None):
+    """
+    Serves the pre-built gzip catalog of the customer's price list as a file, so
+    nginx can stream it (X-Accel-Redirect) without running the row-building loop.
+    The body is sent as `application/gzip`, not with a gzip Content-Encoding
+    (nginx drops that header on X-Accel-Redirect): the client gunzips it itself.
+    The JSON inside is the full `get_items_by_customer_code` response, including
+    a `sync_token` to continue with delta syncs. Honors If-None-Match.
+    """
+    from mobile_app.tasks import build_catalog_snapshot, get_catalog_snapshot_info
+
+    if not customer_code:
+        return {"status": "error", "message": "Missing customer_code"}
+
+    customer   = get_customer_by_code(customer_code)
+    price_list = (customer.default_price_list if customer else None) or FALLBACK_PRICE_LIST
+
+    snapshot = get_catalog_snapshot_info(price_list)
+    if not snapshot:
+        snapshot = build_catalog_snapshot(price_list)
+
+    if frappe.get_request_header("If-None-Match") == snapshot["etag"]:
+        return Response(status=304, headers={"ETag": snapshot["etag"]})
+
+    response = send_private_file(snapshot["file"])
+    response.mimetype        = "application/gzip"
+    response.headers["ETag"] = snapshot["etag"]
+    if "X-Accel-Redirect" not in response.headers:
+        response.headers["Content-Length"] = str(snapshot["size"])
+    return response
+
+
+def enqueue_catalog_snapshots():
+    """Rebuilds the catalog snapshots in the background once the transaction commits."""
+    frappe.enqueue(
+        "mobile_app.tasks.build_catalog_snapshots",
+        queue="long",
+        job_id="mobile_app_catalog_snapshots",
+        deduplicate=True,
+        enqueue_after_commit=True,
+    )
+
+
 ################################################################################
 ######################  Create Sales Order Function ############################
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def create_sales_order():
+    """
+    Creates and submits a Sales Order from a mobile cart. With `"async": 1` the
+    cart is validated, insert+submit is queued and a `job_id` is returned right
+    away; poll `get_job_status` for the final `order_id` or error.
+    Retries carrying the same Idempotency-Key get the first response back.
+    """
     try:
         data = None
 
@@ -746,69 +2457,114 @@ def create_sales_order():
         if not data:
             data = frappe.form_dict
 
-        code_envoye = data.get("customer_code")
-        items       = data.get("items")
+        return run_idempotent(
+            "create_sales_order", get_idempotency_key(data), lambda: _create_sales_order(data),
+            error_response=lambda message: {"status": "error", "message": message},
+            scope=data.get("customer_code"),
+            payload=data
+        )
 
-        if not code_envoye:
-            return {"status": "error", "message": "Missing customer_code"}
-        if not items:
-            return {"status": "error", "message": "Missing items"}
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "Mobile Order Error")
+        return {"status": "error", "message": str(e)}
 
-        if isinstance(items, str):
-            items = json.loads(items)
 
-        customer_id = frappe.db.get_value("Customer", {"custom_customer_code": code_envoye}, "name")
-        if not customer_id:
-            return {"status": "error", "message": f"Customer '{code_envoye}' not found in ERPNext"}
+def _create_sales_order(data):
+    code_envoye = data.get("customer_code")
+    items       = data.get("items")
+
+    if not code_envoye:
+        return {"status": "error", "message": "Missing customer_code"}
+    if not items:
+        return {"status": "error", "message": "Missing items"}
+
+    if isinstance(items, str):
+        items = json.loads(items)
 
-        customer_data = frappe.db.get_value(
-            "Customer", customer_id, "default_price_list", as_dict=True
+    so, error = _build_sales_order(code_envoye, items)
+    if error:
+        return error
+
+    if cint(data.get("async")):
+        job_id = enqueue_mobile_job(
+            "mobile_app.api._insert_sales_order", customer_code=code_envoye, items=items
         )
-        price_list = (customer_data.get("default_price_list") if customer_data else None) or "Public - Alger"
-
-        company    = "OPTILENS ALGER"
-        default_wh = frappe.db.get_value("Warehouse", {"company": company, "is_group": 0}, "name")
-
-        so = frappe.get_doc({
-            "doctype":          "Sales Order",
-            "customer":         customer_id,
-            "company":          company,
-            "transaction_date": frappe.utils.today(),
-            "delivery_date":    frappe.utils.add_days(frappe.utils.today(), 2),
-            "items":            []
-        })
+        return {"status": "queued", "job_id": job_id}
 
-        for it in items:
-            item_code = it.get("item_code")
-            if not item_code:
-                continue
+    so.insert(ignore_permissions=True)
+    so.submit()
+    frappe.db.commit()
 
-            rate = frappe.db.get_value(
-                "Item Price",
-                {"item_code": item_code, "price_list": price_list, "selling": 1},
-                "price_list_rate"
-            ) or 0.0
-
-            uom = frappe.db.get_value("Item", item_code, "stock_uom") or "Nos"
-
-            so.append("items", {
-                "item_code":     item_code,
-                "qty":           float(it.get("qty") or 1),
-                "rate":          float(rate),
-                "uom":           uom,
-                "warehouse":     default_wh or "Magasins - OA",
-                "delivery_date": so.delivery_date
-            })
+    return {"status": "success", "order_id": so.name}
 
-        so.insert(ignore_permissions=True)
-        so.submit()
-        frappe.db.commit()
 
-        return {"status": "success", "order_id": so.name}
+def _build_sales_order(code_envoye, items):
+    """Validates a mobile cart. Returns (unsaved Sales Order, None) or (None, error response)."""
+    customer = get_customer_by_code(code_envoye)
+    if not customer:
+        return None, {"status": "error", "message": f"Customer '{code_envoye}' not found in ERPNext"}
+
+    customer_id = customer.name
+    price_list  = customer.default_price_list or FALLBACK_PRICE_LIST
+    price_map   = get_price_map(price_list)
+
+    # Resolve every line in one pass so the query count does not grow with the cart
+    item_codes = list({it.get("item_code") for it in items if it.get("item_code")})
+    item_rows  = {}
+    if item_codes:
+        item_rows = {
+            row.name: row for row in frappe.get_all(
+                "Item",
+                filters={"name": ["in", item_codes], "disabled": 0},
+                fields=["name", "stock_uom"]
+            )
+        }
+
+    unknown = sorted(code for code in item_codes if code not in item_rows)
+    if unknown:
+        return None, {"status": "error", "message": f"Unknown or disabled items: {', '.join(unknown)}"}
+
+    company    = "OPTILENS ALGER"
+    default_wh = frappe.db.get_value("Warehouse", {"company": company, "is_group": 0}, "name")
+
+    so = frappe.get_doc({
+        "doctype":          "Sales Order",
+        "customer":         customer_id,
+        "company":          company,
+        "transaction_date": frappe.utils.today(),
+        "delivery_date":    frappe.utils.add_days(frappe.utils.today(), 2),
+        "items":            []
+    })
+
+    for it in items:
+        item_code = it.get("item_code")
+        if not item_code:
+            continue
+
+        rate = price_map.get(item_code, 0.0)
+        uom  = item_rows[item_code].stock_uom or "Nos"
+
+        so.append("items", {
+            "item_code":     item_code,
+            "qty":           float(it.get("qty") or 1),
+            "rate":          float(rate),
+            "uom":           uom,
+            "warehouse":     default_wh or "Magasins - OA",
+            "delivery_date": so.delivery_date
+        })
+
+    return so, None
 
-    except Exception as e:
-        frappe.log_error(frappe.get_traceback(), "Mobile Order Error")
-        return {"status": "error", "message": str(e)}
+
+def _insert_sales_order(customer_code, items):
+    """Background body of the async mode of `create_sales_order`."""
+    so, error = _build_sales_order(customer_code, items)
+    if error:
+        return error
+
+    so.insert(ignore_permissions=True)
+    so.submit()
+    return {"status": "success", "order_id": so.name}
 
 
 ################################################################################
@@ -816,15 +2572,18 @@ def create_sales_order():
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def get_customer_orders(customer_code):
     if not customer_code:
         return {"status": "error", "message": "Missing customer_code"}
 
-    customer_id = frappe.db.get_value("Customer", {"custom_customer_code": customer_code}, "name")
+    customer = get_customer_by_code(customer_code)
 
-    if not customer_id:
+    if not customer:
         return {"status": "error", "message": f"Customer '{customer_code}' not found"}
 
+    customer_id = customer.name
+
     orders = frappe.get_all(
         "Sales Order",
         filters={"customer": customer_id},
@@ -839,6 +2598,7 @@ def get_customer_orders(customer_code):
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def get_order_details(order_id=None):
     if not order_id:
         order_id = frappe.form_dict.get('order_id')
@@ -847,10 +2607,16 @@ def get_order_details(order_id=None):
         return {"status": "error", "message": "Missing order ID"}
 
     try:
-        doc = frappe.get_doc("Sales Order", order_id, ignore_permissions=True)
+        doc = get_parent_projection("Sales Order", order_id, ["name", "grand_total"])
+        if not doc:
+            return {"status": "error", "message": f"Order not found: {order_id}"}
+
+        rows = get_child_projection(
+            "Sales Order", order_id, "Sales Order Item", ["item_code", "qty", "rate", "amount"]
+        )
 
         items_list = []
-        for item in doc.items:
+        for item in rows:
             items_list.append({
                 "item_code": item.item_code,
                 "qty":       item.qty,
@@ -873,6 +2639,7 @@ def get_order_details(order_id=None):
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def create_customer_complaint():
     try:
         if frappe.request.method != "POST":
@@ -880,30 +2647,41 @@ def create_customer_complaint():
 
         data = json.loads(frappe.request.data)
 
-        doc = frappe.get_doc({
-            "doctype":                "reclamtion client",
-            "client":                 data.get("client"),
-            "date_reception":         data.get("date_reception") or frappe.utils.today(),
-            "documents_reference":    data.get("reference"),
-            "desciption_reclamation": data.get("description"),
-            "docstatus":              0
-        })
-
-        doc.insert(ignore_permissions=True)
-        frappe.db.commit()
-
-        return {"message": "Success", "id": doc.name}
+        return run_idempotent(
+            "create_customer_complaint", get_idempotency_key(data),
+            lambda: _create_customer_complaint(data),
+            error_response=lambda message: {"error": message},
+            scope=data.get("client"),
+            payload=data
+        )
 
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), "Mobile Complaint Error")
         return {"error": str(e)}
 
 
+def _create_customer_complaint(data):
+    doc = frappe.get_doc({
+        "doctype":                "reclamtion client",
+        "client":                 data.get("client"),
+        "date_reception":         data.get("date_reception") or frappe.utils.today(),
+        "documents_reference":    data.get("reference"),
+        "desciption_reclamation": data.get("description"),
+        "docstatus":              0
+    })
+
+    doc.insert(ignore_permissions=True)
+    frappe.db.commit()
+
+    return {"message": "Success", "id": doc.name}
+
+
 ################################################################################
 ######################  Change Customer Code Function ##########################
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def change_customer_code(old_code=None, new_code=None):
     if not old_code or not new_code:
         return {"success": False, "error": "Missing old_code or new_code"}
@@ -932,6 +2710,7 @@ def change_customer_code(old_code=None, new_code=None):
     try:
         frappe.db.set_value("Customer", customer[0]["name"], "custom_customer_code", new_code)
         frappe.db.commit()
+        invalidate_customer_code(old_code, new_code)
 
         return {
             "success":       True,
@@ -949,6 +2728,7 @@ def change_customer_code(old_code=None, new_code=None):
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def get_companies(token=None):
     try:
         user = get_user_from_sid(token)
@@ -961,7 +2741,7 @@ def get_companies(token=None):
 
         # Filter by allowed companies if restrictions exist
         if allowed_companies:
-            filters["name"] = ["in", allowed_companies]
+            filters["name"] = ["in", list(allowed_companies)]
 
         companies = frappe.get_all(
             "Company",
@@ -983,10 +2763,18 @@ def get_companies(token=None):
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
-def get_material_requests(token=None, limit=20, offset=0, search_text=None, status=None):
+@instrument_endpoint
+def get_material_requests(token=None, limit=20, offset=0, search_text=None, status=None, cursor=None,
+                          include_items=1):
+    """
+    Lists the Material Requests visible to the user. The item rows of the whole
+    page are loaded with one query; pass `include_items=0` to skip them and
+    fetch them lazily through `get_material_request_detail`.
+    """
     try:
         limit  = int(limit  or 20)
         offset = int(offset or 0)
+        include_items = cint(include_items)
 
         user = get_user_from_sid(token)
         if not user:
@@ -997,10 +2785,10 @@ def get_material_requests(token=None, limit=20, offset=0, search_text=None, stat
         filters = {}
 
         if allowed_companies:
-            filters["company"] = ["in", allowed_companies]
+            filters["company"] = ["in", list(allowed_companies)]
 
         if allowed_warehouses:
-            filters["set_warehouse"] = ["in", allowed_warehouses]
+            filters["set_warehouse"] = ["in", list(allowed_warehouses)]
 
         is_search = bool(search_text and str(search_text).strip())
         if is_search:
@@ -1009,9 +2797,18 @@ def get_material_requests(token=None, limit=20, offset=0, search_text=None, stat
         if status and status != "All":
             filters["status"] = status
 
+        or_filters = None
+        if cursor and not is_search:
+            try:
+                or_filters = _keyset_filters(filters, "transaction_date", cursor)
+            except frappe.ValidationError:
+                return {"error": "Invalid cursor"}
+            offset = 0
+
         requests = frappe.get_all(
             "Material Request",
             filters=filters,
+            or_filters=or_filters,
             fields=[
                 "name", "company", "transaction_date", "status",
                 "material_request_type", "schedule_date",
@@ -1019,22 +2816,29 @@ def get_material_requests(token=None, limit=20, offset=0, search_text=None, stat
                 "buying_price_list",
                 "docstatus"
             ],
-            order_by="transaction_date desc",
+            order_by="transaction_date desc, name desc",
             limit=20  if is_search else limit,
             start=0   if is_search else offset,
             ignore_permissions=True
         )
 
-        result = []
-        for req in requests:
-            items = frappe.get_all(
+        items_by_parent = {}
+        if include_items and requests:
+            mr_items = frappe.get_all(
                 "Material Request Item",
-                filters={"parent": req["name"]},
-                fields=["item_code", "item_name", "qty",
+                filters={"parent": ["in", [req["name"] for req in requests]],
+                         "parenttype": "Material Request"},
+                fields=["parent", "item_code", "item_name", "qty",
                         "received_qty", "uom", "warehouse", "schedule_date"],
+                order_by="parent asc, idx asc",
                 ignore_permissions=True
             )
-            result.append({
+            for it in mr_items:
+                items_by_parent.setdefault(it.pop("parent"), []).append(it)
+
+        result = []
+        for req in requests:
+            row = {
                 "name":                  req["name"],
                 "company":               req["company"]                or "",
                 "transaction_date":      str(req["transaction_date"]   or ""),
@@ -1045,10 +2849,16 @@ def get_material_requests(token=None, limit=20, offset=0, search_text=None, stat
                 "set_from_warehouse":    req["set_from_warehouse"]     or "",
                 "price_list":            req["buying_price_list"]      or "",
                 "docstatus":             req["docstatus"],
-                "items":                 items
-            })
+            }
+            if include_items:
+                row["items"] = items_by_parent.get(req["name"], [])
+            result.append(row)
 
-        return {"material_requests": result, "is_search": is_search}
+        return {
+            "material_requests": result,
+            "is_search":         is_search,
+            "next_cursor":       None if is_search else _next_cursor(requests, "transaction_date", limit),
+        }
 
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), "get_material_requests error")
@@ -1060,6 +2870,7 @@ def get_material_requests(token=None, limit=20, offset=0, search_text=None, stat
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def get_material_request_detail(token=None, name=None):
     try:
         if not name:
@@ -1069,11 +2880,14 @@ def get_material_request_detail(token=None, name=None):
         if not user:
             return {"success": False, "error": "Invalid session"}
 
-        if not frappe.db.exists("Material Request", name):
+        doc = get_parent_projection(
+            "Material Request", name,
+            ["name", "company", "transaction_date", "status", "material_request_type", "schedule_date",
+             "set_warehouse", "set_from_warehouse", "buying_price_list", "docstatus"]
+        )
+        if not doc:
             return {"success": False, "error": "Material Request not found"}
 
-        doc = frappe.get_doc("Material Request", name)
-
         # Enforce company and warehouse restrictions if they exist
         allowed_companies, allowed_warehouses = get_user_permissions(user)
         if allowed_companies and doc.company and doc.company not in allowed_companies:
@@ -1081,8 +2895,13 @@ def get_material_request_detail(token=None, name=None):
         if allowed_warehouses and doc.set_warehouse and doc.set_warehouse not in allowed_warehouses:
             return {"success": False, "error": "Access denied for this Material Request (Warehouse restriction)"}
 
+        rows = get_child_projection(
+            "Material Request", name, "Material Request Item",
+            ["item_code", "item_name", "qty", "received_qty", "uom", "warehouse", "schedule_date"]
+        )
+
         items = []
-        for it in doc.items:
+        for it in rows:
             items.append({
                 "item_code":     it.item_code          or "",
                 "item_name":     it.item_name          or "",
@@ -1120,118 +2939,158 @@ def get_material_request_detail(token=None, name=None):
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def create_material_request():
+    """Creates a draft Material Request. Supports the same `"async": 1` mode as `create_sales_order`."""
     try:
         if frappe.request.method != "POST":
             return {"success": False, "error": "Method not allowed"}
 
         data               = json.loads(frappe.request.data)
         token              = data.get("token")
-        items              = data.get("items")
-        purpose            = data.get("purpose", "Material Transfer")
-        
+
         user = get_user_from_sid(token)
         if not user:
             return {"success": False, "error": "Invalid session"}
 
-        allowed_companies, allowed_warehouses = get_user_permissions(user)
+        return run_idempotent(
+            "create_material_request", get_idempotency_key(data),
+            lambda: _create_material_request(data, user),
+            error_response=lambda message: {"success": False, "error": message},
+            scope=user,
+            payload=data
+        )
 
-        # Dynamic company assignment according to user permissions
-        company = data.get("company")
-        if not company:
-            if allowed_companies:
-                company = allowed_companies[0]
-            else:
-                company = frappe.db.get_default("company") or "OPTILENS ALGER"
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "create_material_request error")
+        return {"success": False, "error": str(e)}
 
-        if allowed_companies and company not in allowed_companies:
-            return {"success": False, "error": f"Access denied for company '{company}'"}
 
-        set_warehouse      = data.get("set_warehouse",      "")
-        set_from_warehouse = data.get("set_from_warehouse", "")
-        price_list         = data.get("price_list",         "")
-        required_by        = data.get("required_by") or frappe.utils.add_days(frappe.utils.today(), 7)
+def _create_material_request(data, user):
+    doc, error = _build_material_request(data, user)
+    if error:
+        return error
 
-        if allowed_warehouses and set_warehouse and set_warehouse not in allowed_warehouses:
-            return {"success": False, "error": f"Access denied for warehouse '{set_warehouse}'"}
-        if allowed_warehouses and set_from_warehouse and set_from_warehouse not in allowed_warehouses:
-            return {"success": False, "error": f"Access denied for warehouse '{set_from_warehouse}'"}
+    if cint(data.get("async")):
+        job_id = enqueue_mobile_job("mobile_app.api._insert_material_request", data=data, user=user)
+        return {"success": True, "status": "queued", "job_id": job_id}
 
-        if not items:
-            return {"success": False, "error": "Missing items"}
+    doc.insert(ignore_permissions=True)
+    frappe.db.commit()
 
-        if isinstance(items, str):
-            items = json.loads(items)
+    return _material_request_response(doc, data)
+
+
+def _build_material_request(data, user):
+    """Validates a mobile Material Request. Returns (unsaved doc, None) or (None, error response)."""
+    items              = data.get("items")
+    purpose            = data.get("purpose", "Material Transfer")
 
-        if purpose == "Material Transfer":
-            if not set_from_warehouse:
-                return {"success": False, "error": "Source warehouse required for Material Transfer"}
-            if not set_warehouse:
-                return {"success": False, "error": "Target warehouse required for Material Transfer"}
-
-        elif purpose == "Material Issue":
-            if not set_from_warehouse:
-                return {"success": False, "error": "Source warehouse required for Material Issue"}
-            if not set_warehouse:
-                set_warehouse = set_from_warehouse
+    allowed_companies, allowed_warehouses = get_user_permissions(user)
+
+    # Dynamic company assignment according to user permissions
+    company = data.get("company")
+    if not company:
+        if allowed_companies:
+            company = min(allowed_companies)
         else:
-            if not set_warehouse:
-                set_warehouse = frappe.db.get_value(
-                    "Warehouse", {"company": company, "is_group": 0}, "name"
-                ) or ""
-
-        doc_fields = {
-            "doctype":               "Material Request",
-            "material_request_type": purpose,
-            "transaction_date":      frappe.utils.today(),
-            "schedule_date":         required_by,
-            "company":               company,
-            "set_warehouse":         set_warehouse,
-            "items":                 [],
-        }
+            company = frappe.db.get_default("company") or "OPTILENS ALGER"
 
-        if set_from_warehouse and purpose in ["Material Transfer", "Material Issue", "Material Transfer for Manufacture"]:
-            doc_fields["set_from_warehouse"] = set_from_warehouse
+    if allowed_companies and company not in allowed_companies:
+        return None, {"success": False, "error": f"Access denied for company '{company}'"}
 
-        if price_list:
-            doc_fields["buying_price_list"] = price_list
+    set_warehouse      = data.get("set_warehouse",      "")
+    set_from_warehouse = data.get("set_from_warehouse", "")
+    price_list         = data.get("price_list",         "")
+    required_by        = data.get("required_by") or frappe.utils.add_days(frappe.utils.today(), 7)
 
-        doc = frappe.get_doc(doc_fields)
+    if allowed_warehouses and set_warehouse and set_warehouse not in allowed_warehouses:
+        return None, {"success": False, "error": f"Access denied for warehouse '{set_warehouse}'"}
+    if allowed_warehouses and set_from_warehouse and set_from_warehouse not in allowed_warehouses:
+        return None, {"success": False, "error": f"Access denied for warehouse '{set_from_warehouse}'"}
 
-        for it in items:
-            item_code = it.get("item_code")
-            if not item_code or not frappe.db.exists("Item", item_code):
-                continue
+    if not items:
+        return None, {"success": False, "error": "Missing items"}
+
+    if isinstance(items, str):
+        items = json.loads(items)
+
+    if purpose == "Material Transfer":
+        if not set_from_warehouse:
+            return None, {"success": False, "error": "Source warehouse required for Material Transfer"}
+        if not set_warehouse:
+            return None, {"success": False, "error": "Target warehouse required for Material Transfer"}
+
+    elif purpose == "Material Issue":
+        if not set_from_warehouse:
+            return None, {"success": False, "error": "Source warehouse required for Material Issue"}
+        if not set_warehouse:
+            set_warehouse = set_from_warehouse
+    else:
+        if not set_warehouse:
+            set_warehouse = frappe.db.get_value(
+                "Warehouse", {"company": company, "is_group": 0}, "name"
+            ) or ""
+
+    doc_fields = {
+        "doctype":               "Material Request",
+        "material_request_type": purpose,
+        "transaction_date":      frappe.utils.today(),
+        "schedule_date":         required_by,
+        "company":               company,
+        "set_warehouse":         set_warehouse,
+        "items":                 [],
+    }
 
-            uom = frappe.db.get_value("Item", item_code, "stock_uom") or "Nos"
-            doc.append("items", {
-                "item_code":     item_code,
-                "qty":           float(it.get("qty") or 1),
-                "uom":           uom,
-                "warehouse":     it.get("warehouse") or set_warehouse,
-                "schedule_date": required_by,
-            })
+    if set_from_warehouse and purpose in ["Material Transfer", "Material Issue", "Material Transfer for Manufacture"]:
+        doc_fields["set_from_warehouse"] = set_from_warehouse
 
-        if not doc.items:
-            return {"success": False, "error": "No valid items found"}
+    if price_list:
+        doc_fields["buying_price_list"] = price_list
 
-        doc.insert(ignore_permissions=True)
-        frappe.db.commit()
+    doc = frappe.get_doc(doc_fields)
 
-        return {
-            "success":            True,
-            "id":                 doc.name,
-            "status":             doc.status,
-            "company":            company,
-            "purpose":            purpose,
-            "price_list":         price_list,
-            "set_warehouse":      set_warehouse,
-            "set_from_warehouse": set_from_warehouse,
-        }
+    for it in items:
+        item_code = it.get("item_code")
+        if not item_code or not frappe.db.exists("Item", item_code):
+            continue
 
-    except Exception as e:
-        frappe.log_error(frappe.get_traceback(), "create_material_request error")
-        return {"success": False, "error": str(e)}
+        uom = frappe.db.get_value("Item", item_code, "stock_uom") or "Nos"
+        doc.append("items", {
+            "item_code":     item_code,
+            "qty":           float(it.get("qty") or 1),
+            "uom":           uom,
+            "warehouse":     it.get("warehouse") or set_warehouse,
+            "schedule_date": required_by,
+        })
+
+    if not doc.items:
+        return None, {"success": False, "error": "No valid items found"}
+
+    return doc, None
+
+
+def _material_request_response(doc, data):
+    return {
+        "success":            True,
+        "id":                 doc.name,
+        "status":             doc.status,
+        "company":            doc.company,
+        "purpose":            doc.material_request_type,
+        "price_list":         data.get("price_list", ""),
+        "set_warehouse":      doc.set_warehouse,
+        "set_from_warehouse": data.get("set_from_warehouse", ""),
+    }
+
+
+def _insert_material_request(data, user):
+    """Background body of the async mode of `create_material_request`."""
+    doc, error = _build_material_request(data, user)
+    if error:
+        return error
+
+    doc.insert(ignore_permissions=True)
+    return _material_request_response(doc, data)
 
 
 ################################################################################
@@ -1239,6 +3098,7 @@ def create_material_request():
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def manage_material_request(name=None, action="submit"):
     try:
         token = None
@@ -1307,70 +3167,98 @@ def manage_material_request(name=None, action="submit"):
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def create_stock_entry_from_mr(name=None):
+    """Creates a draft Stock Entry from a submitted Material Transfer request. Supports `"async": 1`."""
     try:
-        token = None
+        token    = None
+        is_async = False
         if frappe.request and frappe.request.method == "POST":
             content_type = frappe.request.headers.get("Content-Type", "")
             if "application/json" in content_type:
-                data  = json.loads(frappe.request.data or "{}")
-                name  = name or data.get("name")
-                token = data.get("token")
+                data     = json.loads(frappe.request.data or "{}")
+                name     = name or data.get("name")
+                token    = data.get("token")
+                is_async = cint(data.get("async"))
 
         user = get_user_from_sid(token)
         if not user:
             return {"error": "Invalid session"}
 
-        if not name:
-            return {"error": "Missing Material Request name"}
+        error = _check_mr_for_stock_entry(name, user)
+        if error:
+            return error
 
-        if not frappe.db.exists("Material Request", name):
-            return {"error": f"Material Request '{name}' not found"}
+        if is_async:
+            job_id = enqueue_mobile_job("mobile_app.api._insert_stock_entry_from_mr", name=name, user=user)
+            return {"success": True, "status": "queued", "job_id": job_id}
 
-        mr = frappe.get_doc("Material Request", name)
+        response = _insert_stock_entry_from_mr(name, user, checked=True)
+        frappe.db.commit()
+        return response
 
-        # Validate permission rules
-        allowed_companies, allowed_warehouses = get_user_permissions(user)
-        if allowed_companies and mr.company and mr.company not in allowed_companies:
-            return {"error": "Access denied for this Material Request"}
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "create_stock_entry_from_mr error")
+        return {"error": str(e)}
 
-        if mr.docstatus != 1:
-            return {"error": "Material Request must be submitted first"}
-        if mr.material_request_type != "Material Transfer":
-            return {"error": "Only Material Transfer type can create a Stock Entry"}
-        if mr.status in ["Transferred", "Received", "Stopped"]:
-            return {"error": f"Material Request already {mr.status}"}
 
-        from erpnext.stock.doctype.material_request.material_request import make_stock_entry
+def _check_mr_for_stock_entry(name, user):
+    """Returns an error response if `user` cannot create a Stock Entry from Material Request `name`."""
+    if not name:
+        return {"error": "Missing Material Request name"}
 
-        se = make_stock_entry(name)
-        se.insert(ignore_permissions=True)
-        frappe.db.commit()
+    if not frappe.db.exists("Material Request", name):
+        return {"error": f"Material Request '{name}' not found"}
 
-        items = []
-        for it in se.items:
-            items.append({
-                "item_code":      it.item_code   or "",
-                "item_name":      it.item_name   or "",
-                "qty":            float(it.qty   or 0),
-                "from_warehouse": it.s_warehouse or "",
-                "to_warehouse":   it.t_warehouse or "",
-                "uom":            it.uom         or "",
-            })
+    mr = frappe.get_doc("Material Request", name)
 
-        return {
-            "success":        True,
-            "stock_entry_id": se.name,
-            "mr_name":        name,
-            "from_warehouse": se.from_warehouse or "",
-            "to_warehouse":   se.to_warehouse   or "",
-            "items_count":    len(se.items),
-            "items":          items,
-        }
+    # Validate permission rules
+    allowed_companies, allowed_warehouses = get_user_permissions(user)
+    if allowed_companies and mr.company and mr.company not in allowed_companies:
+        return {"error": "Access denied for this Material Request"}
 
-    except Exception as e:
-        frappe.log_error(frappe.get_traceback(), "create_stock_entry_from_mr error")
-        return {"error": str(e)}
+    if mr.docstatus != 1:
+        return {"error": "Material Request must be submitted first"}
+    if mr.material_request_type != "Material Transfer":
+        return {"error": "Only Material Transfer type can create a Stock Entry"}
+    if mr.status in ["Transferred", "Received", "Stopped"]:
+        return {"error": f"Material Request already {mr.status}"}
+
+    return None
+
+
+def _insert_stock_entry_from_mr(name, user, checked=False):
+    """Inserts the Stock Entry; also the background body of the async mode."""
+    if not checked:
+        error = _check_mr_for_stock_entry(name, user)
+        if error:
+            return error
+
+    from erpnext.stock.doctype.material_request.material_request import make_stock_entry
+
+    se = make_stock_entry(name)
+    se.insert(ignore_permissions=True)
+
+    items = []
+    for it in se.items:
+        items.append({
+            "item_code":      it.item_code   or "",
+            "item_name":      it.item_name   or "",
+            "qty":            float(it.qty   or 0),
+            "from_warehouse": it.s_warehouse or "",
+            "to_warehouse":   it.t_warehouse or "",
+            "uom":            it.uom         or "",
+        })
+
+    return {
+        "success":        True,
+        "stock_entry_id": se.name,
+        "mr_name":        name,
+        "from_warehouse": se.from_warehouse or "",
+        "to_warehouse":   se.to_warehouse   or "",
+        "items_count":    len(se.items),
+        "items":          items,
+    }
 
 
 ################################################################################
@@ -1378,6 +3266,7 @@ def create_stock_entry_from_mr(name=None):
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def get_warehouses(token=None, company=None):
     try:
         user = get_user_from_sid(token)
@@ -1391,10 +3280,10 @@ def get_warehouses(token=None, company=None):
         if company:
             filters["company"] = company
         elif allowed_companies:
-            filters["company"] = ["in", allowed_companies]
+            filters["company"] = ["in", list(allowed_companies)]
 
         if allowed_warehouses:
-            filters["name"] = ["in", allowed_warehouses]
+            filters["name"] = ["in", list(allowed_warehouses)]
 
         warehouses = frappe.get_all(
             "Warehouse",
@@ -1416,6 +3305,7 @@ def get_warehouses(token=None, company=None):
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def get_companies(token=None):
     try:
         user = get_user_from_sid(token)
@@ -1428,7 +3318,7 @@ def get_companies(token=None):
 
         # If restrictions exist, filter by allowed companies. Otherwise, fetch all.
         if allowed_companies:
-            filters["name"] = ["in", allowed_companies]
+            filters["name"] = ["in", list(allowed_companies)]
 
         companies = frappe.get_all(
             "Company",
@@ -1450,6 +3340,7 @@ def get_companies(token=None):
 ################################################################################
 
 @frappe.whitelist(allow_guest=True)
+@instrument_endpoint
 def get_price_lists(token=None):
     try:
         user = get_user_from_sid(token)
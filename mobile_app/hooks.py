@@ -145,6 +145,33 @@ app_license = "mit"
 # 	}
 # }
 
+doc_events = {
+	"User Permission": {
+		"on_update": "mobile_app.api.invalidate_user_permissions",
+		"on_trash": "mobile_app.api.invalidate_user_permissions",
+	},
+	"Customer": {
+		"on_update": "mobile_app.api.on_customer_change",
+		"on_trash": "mobile_app.api.on_customer_change",
+	},
+	"Item": {
+		"on_update": "mobile_app.api.on_item_change",
+		"after_delete": "mobile_app.api.on_item_change",
+	},
+	"Annonce mobile": {
+		"on_submit": "mobile_app.api.on_announcement_change",
+		"on_cancel": "mobile_app.api.on_announcement_change",
+		"on_update_after_submit": "mobile_app.api.on_announcement_change",
+	},
+	"Item Price": {
+		"on_update": "mobile_app.api.on_item_price_change",
+		"after_delete": "mobile_app.api.on_item_price_change",
+	},
+	"Mobile Notification": {
+		"on_submit": "mobile_app.api.on_notification_submit",
+	},
+}
+
 # Scheduled Tasks
 # ---------------
 
@@ -166,6 +193,20 @@ app_license = "mit"
 # 	],
 # }
 
+scheduler_events = {
+	"cron": {
+		"0 0 * * *": [
+			"mobile_app.tasks.refresh_active_announcements",
+		],
+		"* * * * *": [
+			"mobile_app.tasks.dispatch_push_outbox",
+		],
+	},
+	"hourly": [
+		"mobile_app.tasks.build_catalog_snapshots",
+	],
+}
+
 # Testing
 # -------
 
@@ -235,6 +276,8 @@ app_license = "mit"
 # 	"mobile_app.auth.validate"
 # ]
 
+on_logout = "mobile_app.api.on_logout"
+
 # Automatically update python controller files with type annotations for this app.
 # export_python_type_annotations = True
 
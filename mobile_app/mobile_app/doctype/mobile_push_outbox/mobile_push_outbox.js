@@ -0,0 +1,8 @@
+// Copyright (c) 2026, ayanaouf and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("Mobile Push Outbox", {
+// 	refresh(frm) {
+
+// 	},
+// });
@@ -0,0 +1,13 @@
+# Copyright (c) 2026, ayanaouf and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class MobilePushOutbox(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Mobile Push Outbox", ["status", "next_attempt_at"])
@@ -0,0 +1,16 @@
+import frappe
+
+from mobile_app.api import ITEM_SEARCH_INDEX
+
+
+def execute():
+    """Adds the FULLTEXT index used by search_items on Item (item_code, item_name)."""
+    if frappe.db.db_type != "mariadb":
+        return
+
+    if frappe.db.has_index("tabItem", ITEM_SEARCH_INDEX):
+        return
+
+    frappe.db.sql_ddl(
+        f"ALTER TABLE `tabItem` ADD FULLTEXT INDEX `{ITEM_SEARCH_INDEX}` (item_code, item_name)"
+    )
@@ -0,0 +1,337 @@
+################################################################################
+# IMPORTS
+################################################################################
+import gzip
+import hashlib
+import json
+import os
+import time
+
+import frappe
+
+from mobile_app.api import (
+    FALLBACK_PRICE_LIST,
+    IMAGE_VARIANTS,
+    PUSH_STATS_KEY,
+    add_to_push_outbox,
+    build_catalog_payload,
+    enqueue_catalog_snapshots,
+    get_public_file_path,
+    get_updates_channel,
+    image_variant_url,
+    publish_notification_update,
+    push_gateway_configured,
+    push_stats_minute_key,
+    rebuild_active_announcements,
+    record_image_variants,
+    set_job_progress,
+)
+
+################################################################################
+######################  Catalog Snapshots ######################################
+################################################################################
+
+# Snapshots live in the site's private files so they can be served through
+# frappe's send_private_file (and nginx X-Accel-Redirect in production).
+CATALOG_SNAPSHOT_DIR  = "mobile_catalog"
+CATALOG_SNAPSHOTS_KEY = "mobile_app:catalog_snapshots"
+
+
+def build_catalog_snapshots():
+    """Rebuilds the gzip catalog snapshot of every enabled selling price list."""
+    price_lists = set(frappe.get_all("Price List", filters={"enabled": 1, "selling": 1}, pluck="name"))
+    price_lists.add(FALLBACK_PRICE_LIST)
+
+    for price_list in price_lists:
+        try:
+            build_catalog_snapshot(price_list)
+        except Exception:
+            frappe.log_error(frappe.get_traceback(), f"Catalog snapshot error ({price_list})")
+
+
+def build_catalog_snapshot(price_list):
+    """Writes the catalog of `price_list` as a gzip JSON file and records its ETag."""
+    payload = json.dumps(build_catalog_payload(price_list), separators=(",", ":"), default=str)
+    content = gzip.compress(payload.encode(), mtime=0)
+    etag    = f'"{hashlib.sha1(content).hexdigest()}"'
+
+    # Named by a hash: scrub() maps names like "A-B" and "A B" to the same file
+    filename  = f"{hashlib.sha1(price_list.encode()).hexdigest()}.json.gz"
+    directory = frappe.get_site_path("private", "files", CATALOG_SNAPSHOT_DIR)
+    path      = os.path.join(directory, filename)
+
+    previous = get_catalog_snapshot_info(price_list)
+    if not previous or previous["etag"] != etag or not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    snapshot = {
+        "file": f"files/{CATALOG_SNAPSHOT_DIR}/{filename}",
+        "etag": etag,
+        "size": len(content),
+    }
+    frappe.cache().hset(CATALOG_SNAPSHOTS_KEY, price_list, snapshot)
+    return snapshot
+
+
+def get_catalog_snapshot_info(price_list):
+    """Returns {file, etag, size} of the current snapshot of `price_list`, or None."""
+    snapshot = frappe.cache().hget(CATALOG_SNAPSHOTS_KEY, price_list)
+    if not snapshot:
+        return None
+    if not os.path.exists(frappe.get_site_path("private", snapshot["file"])):
+        return None
+    return snapshot
+
+
+################################################################################
+######################  Active Announcements ###################################
+################################################################################
+
+def refresh_active_announcements():
+    """Runs at midnight so the first app launch of the day finds the new live set ready."""
+    rebuild_active_announcements()
+
+
+################################################################################
+######################  Image Variants #########################################
+################################################################################
+
+IMAGE_VARIANT_QUALITY = 80
+
+
+def generate_image_variants(file_url, refresh_catalog=False):
+    """Writes the resized variants of an attached image next to the original file."""
+    from PIL import Image, ImageOps, features
+
+    path = get_public_file_path(file_url)
+    if not path or not os.path.exists(path):
+        return
+
+    extension = "webp" if features.check("webp") else "jpg"
+    variants  = {}
+
+    with Image.open(path) as original:
+        image = ImageOps.exif_transpose(original)
+        for variant, width in IMAGE_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((width, width * 4))
+
+            if extension == "jpg" or resized.mode not in ("RGB", "RGBA"):
+                resized = resized.convert("RGB" if extension == "jpg" else "RGBA")
+
+            target   = image_variant_url(path, variant, extension)
+            tmp_path = f"{target}.{os.getpid()}.tmp"
+            resized.save(tmp_path, format="WEBP" if extension == "webp" else "JPEG",
+                         quality=IMAGE_VARIANT_QUALITY, optimize=True)
+            os.replace(tmp_path, target)
+            variants[variant] = image_variant_url(file_url, variant, extension)
+
+    record_image_variants(file_url, variants)
+    if refresh_catalog:
+        enqueue_catalog_snapshots()
+
+
+################################################################################
+######################  Notification Fan-Out ###################################
+################################################################################
+
+# Fan-out rows skip Document validation and naming: they are written already
+# submitted, named like the doctype's autoname with the fan-out id in place of
+# the counter (one row per customer per fan-out, so names stay unique).
+NOTIFICATION_FANOUT_BATCH  = 1000
+NOTIFICATION_FANOUT_FIELDS = ("name", "owner", "modified_by", "creation", "modified",
+                              "docstatus", "customer", "title", "msg", "is_read")
+
+
+def fan_out_notification(title, msg, customers, fanout_id):
+    """
+    Inserts one submitted Mobile Notification per customer, one INSERT and one commit per batch.
+    Each batch is stamped just before its INSERT: the notification feed pages on
+    `creation`, so a stamp taken at job start would sort rows committed seconds
+    later behind cursors that already moved past it.
+    """
+    date  = frappe.utils.getdate().strftime("%d-%m-%Y")
+    user  = frappe.session.user
+    total = len(customers)
+
+    for start in range(0, total, NOTIFICATION_FANOUT_BATCH):
+        batch = customers[start: start + NOTIFICATION_FANOUT_BATCH]
+        names = [f"{customer}-{date}-{fanout_id}" for customer in batch]
+        now   = frappe.utils.now()
+        frappe.db.bulk_insert(
+            "Mobile Notification",
+            NOTIFICATION_FANOUT_FIELDS,
+            [(name, user, user, now, now, 1, customer, title, msg, 0)
+             for name, customer in zip(names, batch, strict=True)],
+        )
+        add_to_push_outbox([
+            {"name": name, "customer": customer, "title": title, "msg": msg}
+            for name, customer in zip(names, batch, strict=True)
+        ])
+        for customer in batch:
+            publish_notification_update(customer)
+        frappe.db.commit()
+        set_job_progress(start + len(batch), total)
+
+    return {"status": "success", "fanout_id": fanout_id, "inserted": total}
+
+
+################################################################################
+######################  Push Outbox Dispatcher #################################
+################################################################################
+
+# Due outbox rows are sent PUSH_BATCH_SIZE at a time, coalesced into one message
+# per customer. A failed message is retried with exponential backoff and marked
+# Failed after PUSH_MAX_ATTEMPTS. The gateway is the callable named by
+# `mobile_app_push_gateway` in site config, called as gateway(messages) and
+# returning {customer: error} for the messages it could not deliver, or the
+# HTTP gateway when only `mobile_app_push_url` is set.
+PUSH_BATCH_SIZE          = 500
+PUSH_MAX_ATTEMPTS        = 6
+PUSH_BACKOFF_BASE        = 30
+PUSH_BACKOFF_MAX         = 3600
+PUSH_DISPATCH_TIME_LIMIT = 50
+PUSH_DISPATCH_LOCK       = "mobile_app:push:dispatch_lock"
+PUSH_HTTP_TIMEOUT        = 10
+PUSH_STATS_MINUTE_TTL    = 3600
+
+
+def dispatch_push_outbox():
+    """Sends due outbox rows until the outbox is drained or the time budget is spent."""
+    if not push_gateway_configured():
+        return
+
+    cache = frappe.cache()
+    lock  = cache.lock(cache.make_key(PUSH_DISPATCH_LOCK), timeout=PUSH_DISPATCH_TIME_LIMIT * 2)
+    if not lock.acquire(blocking=False):
+        return
+
+    try:
+        gateway  = get_push_gateway()
+        deadline = time.monotonic() + PUSH_DISPATCH_TIME_LIMIT
+        while time.monotonic() < deadline and _dispatch_push_batch(gateway):
+            pass
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            pass
+
+
+def _dispatch_push_batch(gateway):
+    rows = frappe.get_all(
+        "Mobile Push Outbox",
+        filters={"status": "Pending", "next_attempt_at": ["<=", frappe.utils.now()]},
+        fields=["name", "customer", "notification", "title", "body"],
+        order_by="next_attempt_at asc",
+        limit=PUSH_BATCH_SIZE
+    )
+    if not rows:
+        return False
+
+    by_customer = {}
+    for row in rows:
+        by_customer.setdefault(row.customer, []).append(row)
+
+    messages = [_push_message(customer, customer_rows) for customer, customer_rows in by_customer.items()]
+    try:
+        failed = gateway(messages) or {}
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "Push gateway error")
+        failed = dict.fromkeys(by_customer, str(e))
+
+    now  = frappe.utils.now()
+    sent = [row.name for customer, customer_rows in by_customer.items() if customer not in failed
+            for row in customer_rows]
+    if sent:
+        frappe.db.sql("""
+            UPDATE `tabMobile Push Outbox`
+            SET status = 'Sent', sent_at = %(now)s, modified = %(now)s
+            WHERE name IN %(names)s
+        """, {"now": now, "names": tuple(sent)})
+
+    retried = 0
+    for customer, error in failed.items():
+        names = [row.name for row in by_customer.get(customer, [])]
+        if names:
+            _schedule_push_retry(names, error, now)
+            retried += len(names)
+
+    frappe.db.commit()
+    _count_push_throughput(sent=len(sent), failed=retried, messages=len(messages))
+    return True
+
+
+def _push_message(customer, rows):
+    """One push per customer and batch: the latest notification, or a count of the new ones."""
+    latest = rows[-1]
+    return {
+        "customer":      customer,
+        "channel":       get_updates_channel(customer),
+        "title":         latest.title,
+        "body":          latest.body if len(rows) == 1 else f"{len(rows)} new notifications",
+        "count":         len(rows),
+        "notifications": [row.notification for row in rows],
+    }
+
+
+def _schedule_push_retry(names, error, now):
+    # MariaDB applies SET assignments left to right, so `attempts` is incremented last
+    frappe.db.sql("""
+        UPDATE `tabMobile Push Outbox`
+        SET status = IF(attempts + 1 >= %(max_attempts)s, 'Failed', 'Pending'),
+            next_attempt_at = DATE_ADD(%(now)s, INTERVAL LEAST(%(base)s * POW(2, attempts), %(max)s) SECOND),
+            last_error = %(error)s,
+            modified = %(now)s,
+            attempts = attempts + 1
+        WHERE name IN %(names)s
+    """, {
+        "max_attempts": PUSH_MAX_ATTEMPTS,
+        "now":          now,
+        "base":         PUSH_BACKOFF_BASE,
+        "max":          PUSH_BACKOFF_MAX,
+        "error":        str(error)[:1000],
+        "names":        tuple(names),
+    })
+
+
+def _count_push_throughput(**counters):
+    cache      = frappe.cache()
+    minute_key = cache.make_key(push_stats_minute_key(frappe.utils.now_datetime()))
+
+    pipe = cache.pipeline()
+    for key in (cache.make_key(PUSH_STATS_KEY), minute_key):
+        pipe.hincrby(key, "batches", 1)
+        for field, value in counters.items():
+            pipe.hincrby(key, field, value)
+    pipe.expire(minute_key, PUSH_STATS_MINUTE_TTL)
+    pipe.execute()
+
+
+def get_push_gateway():
+    path = frappe.conf.get("mobile_app_push_gateway")
+    return frappe.get_attr(path) if path else http_push_gateway
+
+
+def http_push_gateway(messages):
+    """
+    Default gateway: posts the batch as JSON to `mobile_app_push_url`. For local
+    testing, point it at /api/method/mobile_app.api.push_gateway_stub and set
+    `mobile_app_push_stub`.
+    """
+    import requests
+
+    url     = frappe.conf.get("mobile_app_push_url")
+    headers = {}
+    if frappe.conf.get("mobile_app_push_token"):
+        headers["Authorization"] = f"Bearer {frappe.conf.mobile_app_push_token}"
+
+    response = requests.post(url, json={"messages": messages}, headers=headers, timeout=PUSH_HTTP_TIMEOUT)
+    response.raise_for_status()
+
+    payload = response.json()
+    return payload.get("message", payload).get("failed") or {}
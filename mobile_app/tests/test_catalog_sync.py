@@ -0,0 +1,90 @@
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, now
+
+from mobile_app import api
+
+
+class TestCatalogSync(FrappeTestCase):
+    def setUp(self):
+        patcher = patch.object(api, "enqueue_catalog_snapshots")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.since         = str(add_to_date(now(), seconds=-1))
+        self.customer_code = f"_Test Mobile Sync {frappe.generate_hash(length=8)}"
+        suffix             = frappe.generate_hash(length=8)
+        self.items         = [f"_Test Mobile Sync Item {suffix}-{i}" for i in range(3)]
+
+        if not frappe.db.exists("Price List", api.FALLBACK_PRICE_LIST):
+            frappe.get_doc({"doctype": "Price List", "name": api.FALLBACK_PRICE_LIST,
+                            "price_list_name": api.FALLBACK_PRICE_LIST, "currency": "USD", "selling": 1,
+                            "enabled": 1}).db_insert()
+        for item_code in self.items:
+            frappe.get_doc({"doctype": "Item", "name": item_code, "item_code": item_code, "item_name": item_code,
+                            "item_group": "All Item Groups", "stock_uom": "Nos", "is_sales_item": 1}).db_insert()
+            frappe.get_doc({"doctype": "Item Price", "price_list": api.FALLBACK_PRICE_LIST, "item_code": item_code,
+                            "price_list_rate": 100, "selling": 1}).insert()
+
+    def tearDown(self):
+        frappe.db.rollback()
+
+        cache = frappe.cache()
+        cache.srem(api.PRICE_MAP_LISTS_KEY, api.FALLBACK_PRICE_LIST)
+        cache.delete(cache.make_key(api._price_map_key(api.FALLBACK_PRICE_LIST)))
+        api._price_maps.pop((frappe.local.site, api.FALLBACK_PRICE_LIST), None)
+        api.invalidate_customer_code(self.customer_code)
+
+    def delta(self):
+        since = api._encode_token({"price_list": api.FALLBACK_PRICE_LIST, "modified": self.since})
+        response = api.get_items_by_customer_code(self.customer_code, since=since)
+        self.assertEqual(response["status"], "success", response)
+        self.assertTrue(response["is_delta"])
+        return {item["item_code"] for item in response["items"]}, set(response["removed"])
+
+    def test_changed_items_are_sent(self):
+        items, removed = self.delta()
+
+        self.assertTrue(set(self.items) <= items)
+        self.assertFalse(set(self.items) & removed)
+
+    def test_deleted_item_is_a_tombstone(self):
+        frappe.delete_doc("Item", self.items[0], force=True)
+
+        items, removed = self.delta()
+
+        self.assertIn(self.items[0], removed)
+        self.assertNotIn(self.items[0], items)
+
+    def test_disabled_item_is_a_tombstone(self):
+        frappe.db.set_value("Item", self.items[1], "disabled", 1)
+
+        items, removed = self.delta()
+
+        self.assertIn(self.items[1], removed)
+        self.assertNotIn(self.items[1], items)
+
+    def test_deleted_item_price_resends_the_item(self):
+        # Only the deletion of its price is newer than the token
+        frappe.db.set_value("Item", self.items[2], "modified", "2000-01-01", update_modified=False)
+        frappe.delete_doc("Item Price", frappe.db.get_value("Item Price", {"item_code": self.items[2]}))
+
+        items, removed = self.delta()
+
+        self.assertIn(self.items[2], items)
+        self.assertNotIn(self.items[2], removed)
+
+    def test_token_of_another_price_list_sends_the_full_catalog(self):
+        since = api._encode_token({"price_list": "_Test Other Price List", "modified": self.since})
+
+        response = api.get_items_by_customer_code(self.customer_code, since=since)
+
+        self.assertFalse(response["is_delta"])
+        self.assertEqual(response["removed"], [])
+
+    def test_invalid_token_is_rejected(self):
+        response = api.get_items_by_customer_code(self.customer_code, since="not a token")
+
+        self.assertEqual(response["status"], "error")
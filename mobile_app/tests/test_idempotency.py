@@ -0,0 +1,68 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from mobile_app import api
+
+TEST_ENDPOINT = "_test_mobile_idempotency"
+
+
+class TestIdempotency(FrappeTestCase):
+    def setUp(self):
+        self.key   = frappe.generate_hash(length=16)
+        self.calls = 0
+
+    def tearDown(self):
+        frappe.cache().delete_keys(f"mobile_app:idempotency:{TEST_ENDPOINT}:")
+
+    def create(self, response=None):
+        def fn():
+            self.calls += 1
+            return response or {"status": "success", "name": f"DOC-{self.calls}"}
+        return fn
+
+    def run_idempotent(self, fn, scope="CUST-1", payload=None):
+        return api.run_idempotent(
+            TEST_ENDPOINT, self.key, fn,
+            lambda message: {"status": "error", "message": message},
+            scope=scope, payload=payload if payload is not None else {"qty": 1},
+        )
+
+    def test_retry_replays_the_first_response(self):
+        first  = self.run_idempotent(self.create())
+        second = self.run_idempotent(self.create())
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.calls, 1)
+
+    def test_transport_fields_do_not_change_the_payload(self):
+        self.run_idempotent(self.create(), payload={"qty": 1, "token": "a", "idempotency_key": self.key})
+        self.run_idempotent(self.create(), payload={"qty": 1, "token": "b"})
+
+        self.assertEqual(self.calls, 1)
+
+    def test_reused_key_with_another_payload_is_rejected(self):
+        self.run_idempotent(self.create(), payload={"qty": 1})
+        response = self.run_idempotent(self.create(), payload={"qty": 2})
+
+        self.assertEqual(response, {"status": "error", "message": api.IDEMPOTENCY_CONFLICT_MESSAGE})
+        self.assertEqual(self.calls, 1)
+
+    def test_keys_are_scoped_to_the_caller(self):
+        first  = self.run_idempotent(self.create(), scope="CUST-1")
+        second = self.run_idempotent(self.create(), scope="CUST-2")
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.calls, 2)
+
+    def test_error_responses_are_not_stored(self):
+        self.run_idempotent(self.create({"status": "error", "message": "Stock too low"}))
+        response = self.run_idempotent(self.create())
+
+        self.assertEqual(response["status"], "success")
+        self.assertEqual(self.calls, 2)
+
+    def test_no_key_runs_every_time(self):
+        api.run_idempotent(TEST_ENDPOINT, None, self.create(), lambda message: {"error": message})
+        api.run_idempotent(TEST_ENDPOINT, None, self.create(), lambda message: {"error": message})
+
+        self.assertEqual(self.calls, 2)
@@ -0,0 +1,171 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, today
+
+from mobile_app import api
+
+# Rows per seeded list; two rows share each date so pages split inside a date
+SEEDED_ROWS = 7
+PAGE_SIZE   = 3
+# Lists that are not scoped to the test customer are seeded this far in the
+# future so the seeded rows come first, ahead of whatever the site holds
+FUTURE_DAYS = 3650
+
+
+class TestKeysetPagination(FrappeTestCase):
+    def setUp(self):
+        suffix        = frappe.generate_hash(length=8)
+        self.prefix   = f"_T-{suffix}"
+        self.code     = f"_Test Mobile Code {suffix}"
+        self.customer = f"_Test Mobile Customer {suffix}"
+        frappe.get_doc({"doctype": "Customer", "name": self.customer, "customer_name": self.customer,
+                        "custom_customer_code": self.code, "customer_group": "All Customer Groups",
+                        "territory": "All Territories", "customer_type": "Company"}).db_insert()
+
+    def tearDown(self):
+        frappe.db.rollback()
+        api.invalidate_customer_code(self.code)
+
+    def seed(self, doctype, date_field, start=None, **values):
+        """Inserts SEEDED_ROWS rows dated from `start` (today) backwards and returns their (date, name) keys."""
+        keys = []
+        for i in range(SEEDED_ROWS):
+            name = f"{self.prefix}-{doctype}-{i}"
+            date = add_days(start or today(), -(i // 2))
+            frappe.get_doc({"doctype": doctype, "name": name, date_field: date, "docstatus": 1,
+                            **values}).db_insert()
+            keys.append((str(date), name))
+        return keys
+
+    def walk(self, fetch, key, count):
+        """
+        Follows next_cursor from the first page and returns the names of the seeded
+        rows in page order, stopping once `count` of them were seen.
+        """
+        names, cursor = [], None
+        for _ in range(count):
+            response = fetch(cursor)
+            self.assertNotIn("error", response, response)
+            self.assertLessEqual(len(response[key]), PAGE_SIZE)
+            names.extend(row["name"] for row in response[key] if row["name"].startswith(self.prefix))
+            cursor = response["next_cursor"]
+            if not cursor or len(names) >= count:
+                return names
+        self.fail("next_cursor never ran out")
+
+    def make_session(self):
+        sid = frappe.generate_hash(length=32)
+        frappe.db.sql("""
+            INSERT INTO `tabSessions` (user, sid, sessiondata, ipaddress, lastupdate, status)
+            VALUES ('Administrator', %s, '{}', '127.0.0.1', NOW(), 'Active')
+        """, (sid,))
+        self.addCleanup(api.invalidate_session_cache, sid)
+        return sid
+
+    def test_invoice_feed_merges_and_pages_both_doctypes(self):
+        invoices = self.seed("Sales Invoice", "posting_date", customer=self.customer, grand_total=100,
+                             outstanding_amount=0, status="Paid")
+        pos      = self.seed("POS Invoice", "posting_date", customer=self.customer, grand_total=100,
+                             outstanding_amount=0, status="Paid", is_pos=1)
+        expected = [name for _date, name in sorted(invoices + pos, reverse=True)]
+
+        names = self.walk(
+            lambda cursor: api.get_invoices_by_customer_code(self.code, limit=PAGE_SIZE, cursor=cursor),
+            "invoices", len(expected),
+        )
+
+        self.assertEqual(names, expected)
+
+    def test_payments_page_by_payment_not_by_allocation(self):
+        payments = self.seed("Payment Entry", "posting_date", party_type="Customer", party=self.customer,
+                             paid_amount=300, payment_type="Receive")
+        invoices = self.seed("Sales Invoice", "posting_date", customer=self.customer, grand_total=100,
+                             outstanding_amount=0, status="Paid")
+        # Every payment is allocated to two invoices, so the join returns two rows per payment
+        for p, (_date, payment) in enumerate(payments):
+            for idx in (1, 2):
+                frappe.get_doc({"doctype": "Payment Entry Reference", "name": f"{payment}-ref-{idx}",
+                                "parent": payment, "parenttype": "Payment Entry", "parentfield": "references",
+                                "idx": idx, "reference_doctype": "Sales Invoice",
+                                "reference_name": invoices[(p + idx) % SEEDED_ROWS][1],
+                                "allocated_amount": 150}).db_insert()
+        expected = [name for _date, name in sorted(payments, reverse=True)]
+
+        pages = []
+
+        def fetch(cursor):
+            pages.append(api.get_payments_by_customer_code(self.code, limit=PAGE_SIZE, cursor=cursor))
+            return pages[-1]
+
+        names = self.walk(fetch, "payments", len(expected))
+
+        self.assertEqual(names, expected)
+        self.assertEqual([len(page["payments"]) for page in pages], [3, 3, 1])
+        for page in pages:
+            for payment in page["payments"]:
+                self.assertEqual([ref["allocated_amount"] for ref in payment["invoices_payed"]], [150, 150])
+
+    def test_material_requests_page_by_cursor(self):
+        token    = self.make_session()
+        requests = self.seed("Material Request", "transaction_date", start=add_days(today(), FUTURE_DAYS),
+                             material_request_type="Purchase", status="Pending")
+        expected = [name for _date, name in sorted(requests, reverse=True)]
+
+        names = self.walk(
+            lambda cursor: api.get_material_requests(token, limit=PAGE_SIZE, cursor=cursor, include_items=0),
+            "material_requests", len(expected),
+        )
+
+        self.assertEqual(names, expected)
+
+    def test_cursor_and_offset_agree(self):
+        token = self.make_session()
+        self.seed("Material Request", "transaction_date", start=add_days(today(), FUTURE_DAYS),
+                  material_request_type="Purchase", status="Pending")
+
+        first   = api.get_material_requests(token, limit=PAGE_SIZE, include_items=0)
+        by_seek = api.get_material_requests(token, limit=PAGE_SIZE, cursor=first["next_cursor"], include_items=0)
+        by_skip = api.get_material_requests(token, limit=PAGE_SIZE, offset=PAGE_SIZE, include_items=0)
+
+        self.assertEqual([r["name"] for r in by_seek["material_requests"]],
+                         [r["name"] for r in by_skip["material_requests"]])
+
+    def test_notification_feed_starts_at_the_newest_and_walks_back(self):
+        notifications = self.seed("Mobile Notification", "creation", customer=self.customer,
+                                  title="Test", msg="Test", is_read=0)
+        expected      = [name for _date, name in sorted(notifications, reverse=True)]
+
+        first = api.get_notifications_feed(self.code, limit=PAGE_SIZE)
+        self.assertEqual([n.name for n in first["notifications"]], expected[:PAGE_SIZE][::-1])
+        self.assertEqual(first["unread_count"], SEEDED_ROWS)
+
+        names, page = [], first
+        while True:
+            names.extend(n.name for n in reversed(page["notifications"]))
+            if not page["older_cursor"]:
+                break
+            page = api.get_notifications_feed(self.code, limit=PAGE_SIZE, before=page["older_cursor"])
+
+        self.assertEqual(names, expected)
+
+    def test_notification_feed_polls_from_the_head(self):
+        self.seed("Mobile Notification", "creation", customer=self.customer, title="Test", msg="Test", is_read=0)
+        head = api.get_notifications_feed(self.code, limit=PAGE_SIZE)["next_cursor"]
+
+        idle = api.get_notifications_feed(self.code, since=head)
+        self.assertEqual(idle["notifications"], [])
+        self.assertEqual(idle["next_cursor"], head)
+
+        name = f"{self.prefix}-new"
+        frappe.get_doc({"doctype": "Mobile Notification", "name": name, "creation": add_days(today(), 1),
+                        "customer": self.customer, "title": "New", "msg": "New", "is_read": 0,
+                        "docstatus": 1}).db_insert()
+
+        fresh = api.get_notifications_feed(self.code, since=head)
+        self.assertEqual([n.name for n in fresh["notifications"]], [name])
+        self.assertNotEqual(fresh["next_cursor"], head)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = api.get_invoices_by_customer_code(self.code, cursor="not a cursor")
+
+        self.assertEqual(response, {"error": "Invalid cursor"})
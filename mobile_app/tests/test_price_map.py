@@ -0,0 +1,82 @@
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from mobile_app import api
+
+
+class TestPriceMap(FrappeTestCase):
+    def setUp(self):
+        patcher = patch.object(api, "enqueue_catalog_snapshots")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        suffix             = frappe.generate_hash(length=8)
+        self.price_list    = f"_Test Mobile Price List {suffix}"
+        self.own_item      = f"_Test Mobile Item {suffix}-1"
+        self.fallback_item = f"_Test Mobile Item {suffix}-2"
+
+        for price_list in (self.price_list, api.FALLBACK_PRICE_LIST):
+            if not frappe.db.exists("Price List", price_list):
+                frappe.get_doc({"doctype": "Price List", "name": price_list, "price_list_name": price_list,
+                                "currency": "USD", "selling": 1, "enabled": 1}).db_insert()
+        for item_code in (self.own_item, self.fallback_item):
+            frappe.get_doc({"doctype": "Item", "name": item_code, "item_code": item_code, "item_name": item_code,
+                            "item_group": "All Item Groups", "stock_uom": "Nos", "is_sales_item": 1}).db_insert()
+
+        self.own_price = self.make_item_price(self.price_list, self.own_item, 100)
+        self.make_item_price(api.FALLBACK_PRICE_LIST, self.own_item, 70)
+        self.make_item_price(api.FALLBACK_PRICE_LIST, self.fallback_item, 50)
+
+    def tearDown(self):
+        frappe.db.rollback()
+
+        cache = frappe.cache()
+        for price_list in (self.price_list, api.FALLBACK_PRICE_LIST):
+            cache.srem(api.PRICE_MAP_LISTS_KEY, price_list)
+            cache.delete(cache.make_key(api._price_map_key(price_list)))
+            api._price_maps.pop((frappe.local.site, price_list), None)
+        cache.incr(cache.make_key(api.PRICE_MAP_VERSION_KEY))
+
+    def make_item_price(self, price_list, item_code, rate):
+        return frappe.get_doc({"doctype": "Item Price", "price_list": price_list, "item_code": item_code,
+                               "price_list_rate": rate, "selling": 1}).insert()
+
+    def test_fallback_rates_are_merged(self):
+        price_map = api.get_price_map(self.price_list)
+
+        self.assertEqual(price_map[self.own_item], 100)
+        self.assertEqual(price_map[self.fallback_item], 50)
+
+    def test_item_price_change_patches_the_map(self):
+        api.get_price_map(self.price_list)
+
+        self.own_price.price_list_rate = 120
+        self.own_price.save()
+        frappe.db.after_commit.run()
+
+        self.assertEqual(api.get_price_map(self.price_list)[self.own_item], 120)
+
+    def test_item_price_delete_falls_back(self):
+        api.get_price_map(self.price_list)
+
+        self.own_price.delete()
+        frappe.db.after_commit.run()
+
+        self.assertEqual(api.get_price_map(self.price_list)[self.own_item], 70)
+
+    def test_build_racing_a_refresh_is_discarded(self):
+        cache   = frappe.cache()
+        get_all = frappe.get_all
+
+        def get_all_then_refresh(*args, **kwargs):
+            rows = get_all(*args, **kwargs)
+            cache.incr(cache.make_key(api.PRICE_MAP_VERSION_KEY))
+            return rows
+
+        with patch("frappe.get_all", side_effect=get_all_then_refresh):
+            price_map = api._build_price_map(self.price_list)
+
+        self.assertEqual(price_map[self.own_item], 100)
+        self.assertFalse(cache.hgetall(api._price_map_key(self.price_list)))